@@ -2,13 +2,14 @@ import sys
 import nltk
 from nltk.corpus import wordnet as wn
 from tqdm import tqdm
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Import our modules
 from src.builder import ConceptBuilder
 from src.embedders import MultimodalEmbedder
 from src.indexer import CRSIndexer
 from src.wikidata import WikidataFetcher
+from src.graph import RelationInterner
 
 def generate_seed_crs(limit=100):
     print("--- Stage 1 CRS Builder (WordNet + Wikidata) ---")
@@ -17,7 +18,7 @@ def generate_seed_crs(limit=100):
     builder = ConceptBuilder()
     embedder = MultimodalEmbedder()
     indexer = CRSIndexer()
-    wiki = WikidataFetcher()
+    wiki = WikidataFetcher(cache_path="data/metadata/wikidata_cache.sqlite")  # re-runs are served from disk
     
     meta_for_indexing = []
     
@@ -25,7 +26,8 @@ def generate_seed_crs(limit=100):
     synsets = list(wn.all_synsets())[:limit]
     print(f"Processing {len(synsets)} concepts...")
     
-    for syn in tqdm(synsets):
+    concepts = []
+    for syn in synsets:
         # --- A. Basic Data (WordNet) ---
         label = syn.lemmas()[0].name().replace('_', ' ')
         cid = f"wn:{syn.offset()}{syn.pos()}" # Stable ID
@@ -39,42 +41,45 @@ def generate_seed_crs(limit=100):
                 'target_id': f"wn:{hyper.offset()}{hyper.pos()}", 
                 'source': 'wordnet'
             })
-            
-        # --- C. Enrichment (Wikidata) ---
-        # Note: Real ingestion pipelines run async or batch this.
-        # We do it synchronously here for the demo logic.
-        properties = [{'key': 'pos', 'value': syn.pos()}]
-        
-        # 1. Find Wikidata ID
-        qid = wiki.search_entity(label)
-        if qid:
-            # 2. Fetch Deep Properties
-            w_props, w_rels = wiki.get_properties(qid)
-            
-            # Merge
-            properties.extend(w_props)
-            relations.extend(w_rels)
-            
-            # Add QID as a property alias
-            properties.append({'key': 'wikidata_id', 'value': qid})
-            
-            # Be nice to the API
-            time.sleep(0.1) 
 
-        # --- D. Embeddings ---
-        text_context = f"{label}: {definition}"
-        text_emb = embedder.embed_text(text_context)
-        
-        # --- E. Build Artifact ---
-        concept_data = {
+        concepts.append({
             'id': cid,
             'label': label,
             'definition': definition,
-            'text_embedding': text_emb,
             'relations': relations,
-            'properties': properties
-        }
-        
+            'properties': [{'key': 'pos', 'value': syn.pos()}]
+        })
+
+    # --- C. Enrichment (Wikidata) ---
+    # 1. Find Wikidata IDs (no batch search API: run a few lookups at once over the pooled session)
+    labels = [c['label'] for c in concepts]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        qids = list(tqdm(pool.map(wiki.search_entity, labels), total=len(labels), desc="Linking"))
+
+    # 2. Fetch Deep Properties, up to 50 entities per request
+    sent = wiki.stats['requests']  # excludes the linking lookups above
+    details = wiki.get_details_batch(qids)
+    print(f"Fetched {len(details)} entities in {wiki.stats['requests'] - sent} requests.")
+
+    for concept_data, qid in zip(concepts, qids):
+        if qid not in details: continue
+        _, _, w_props, w_rels = details[qid]
+
+        # Merge
+        concept_data['properties'].extend(w_props)
+        concept_data['relations'].extend(w_rels)
+
+        # Add QID as a property alias
+        concept_data['properties'].append({'key': 'wikidata_id', 'value': qid})
+
+    # --- D. Embeddings ---
+    texts = [f"{c['label']}: {c['definition']}" for c in concepts]
+    embeddings = embedder.embed_text_batch(texts)
+
+    # --- E. Build Artifact ---
+    builder.interner = RelationInterner("data", {c['id']: i for i, c in enumerate(concepts)})
+    for concept_data, text_emb in zip(concepts, embeddings):
+        concept_data['text_embedding'] = text_emb
         builder.build_concept(concept_data)
         meta_for_indexing.append(concept_data)
         
@@ -8,6 +8,7 @@ from tqdm import tqdm
 from src.builder import ConceptBuilder
 from src.embedders import MultimodalEmbedder
 from src.indexer import CRSIndexer
+from src.graph import RelationInterner
 
 # Disable Symlink warning
 os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
@@ -66,9 +67,13 @@ def process_batch_offline(batch_synsets, embedder, builder):
             {'key': 'lemmas', 'value': ",".join([l.name() for l in syn.lemmas()])}
         ]
 
+        # Every lemma resolves symbolically (e.g. "dog", "domestic dog", "Canis familiaris")
+        aliases = [l.name().replace('_', ' ') for l in syn.lemmas()[1:]]
+
         item = {
             'id': cid,
             'label': label,
+            'aliases': aliases,
             'definition': definition,
             'relations': relations,
             'properties': props
@@ -96,7 +101,6 @@ def build_offline_crs(limit=None):
     print("--- ⚡ Offline CRS Builder (Intel Optimized) ---")
 
     # Initialize
-    builder = ConceptBuilder()
     embedder = MultimodalEmbedder()  # Auto-detects CPU/GPU
     indexer = CRSIndexer()
 
@@ -109,6 +113,10 @@ def build_offline_crs(limit=None):
         all_synsets = all_synsets[:limit]
         total_count = limit
 
+    # Node ids follow processing order (same as the indexer's), so relations are stored as integers
+    node_ids = {f"wn_{syn.offset()}{syn.pos()}": i for i, syn in enumerate(all_synsets)}
+    builder = ConceptBuilder(interner=RelationInterner("data", node_ids))
+
     print(f"Loaded {total_count} concepts.")
     print(f"Processing in batches of {BATCH_SIZE} on CPU...")
 
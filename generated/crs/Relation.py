@@ -52,8 +52,29 @@ class Relation(object):
             return self._tab.Get(flatbuffers.number_types.Float32Flags, o + self._tab.Pos)
         return 0.0
 
+    # Relation
+    def Target(self):
+        o = flatbuffers.number_types.UOffsetTFlags.py_type(self._tab.Offset(12))
+        if o != 0:
+            return self._tab.Get(flatbuffers.number_types.Int32Flags, o + self._tab.Pos)
+        return -1
+
+    # Relation
+    def TypeCode(self):
+        o = flatbuffers.number_types.UOffsetTFlags.py_type(self._tab.Offset(14))
+        if o != 0:
+            return self._tab.Get(flatbuffers.number_types.Uint16Flags, o + self._tab.Pos)
+        return 0
+
+    # Relation
+    def SourceCode(self):
+        o = flatbuffers.number_types.UOffsetTFlags.py_type(self._tab.Offset(16))
+        if o != 0:
+            return self._tab.Get(flatbuffers.number_types.Uint8Flags, o + self._tab.Pos)
+        return 0
+
 def RelationStart(builder):
-    builder.StartObject(4)
+    builder.StartObject(7)
 
 def Start(builder):
     RelationStart(builder)
@@ -82,6 +103,24 @@ def RelationAddConfidence(builder, confidence):
 def AddConfidence(builder, confidence):
     RelationAddConfidence(builder, confidence)
 
+def RelationAddTarget(builder, target):
+    builder.PrependInt32Slot(4, target, -1)
+
+def AddTarget(builder, target):
+    RelationAddTarget(builder, target)
+
+def RelationAddTypeCode(builder, typeCode):
+    builder.PrependUint16Slot(5, typeCode, 0)
+
+def AddTypeCode(builder, typeCode):
+    RelationAddTypeCode(builder, typeCode)
+
+def RelationAddSourceCode(builder, sourceCode):
+    builder.PrependUint8Slot(6, sourceCode, 0)
+
+def AddSourceCode(builder, sourceCode):
+    RelationAddSourceCode(builder, sourceCode)
+
 def RelationEnd(builder):
     return builder.EndObject()
 
@@ -0,0 +1,85 @@
+import argparse
+import os
+import time
+from tqdm import tqdm
+
+# Import our modules
+from src.builder import ConceptBuilder
+from src.embedders import MultimodalEmbedder
+from src.indexer import CRSIndexer
+from src.wikidata import PropertyLabels
+from src.cache import ResponseCache
+from src.wikidata_dump import stream_concepts
+from src.graph import RelationInterner
+
+# Disable Symlink warning
+os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
+
+BATCH_SIZE = 32
+
+
+def read_id_file(path):
+    if not path: return None
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def ingest_dump(dump_path, ids_path=None, props=None, labels_path=None, limit=None, workers=None):
+    """
+    Offline Wikidata ingestion: dump -> Flatbuffers + FAISS/DuckDB/CSR.
+    No network calls; property labels come from the local cache and/or labels_path.
+    """
+    print("--- 📚 Wikidata Dump Ingestion ---")
+
+    node_ids = {}  # assigned in stream order == indexing order; later targets stay strings
+    builder = ConceptBuilder(interner=RelationInterner("data", node_ids))
+    embedder = MultimodalEmbedder()
+    indexer = CRSIndexer()
+
+    labels = PropertyLabels(ResponseCache("data/metadata/wikidata_cache.sqlite"))
+    if labels_path:
+        print(f"Loaded {labels.load_file(labels_path)} property labels from {labels_path}.")
+
+    qids = read_id_file(ids_path)
+    meta_for_indexing = []
+    batch = []
+    start_time = time.time()
+
+    def flush(batch):
+        embeddings = embedder.embed_text_batch([f"{c['label']}: {c['definition']}" for c in batch])
+        for item, emb in zip(batch, embeddings):
+            item['text_embedding'] = emb
+            builder.build_concept(item)
+            meta_for_indexing.append(item)
+
+    # The stream parses only a few chunks ahead of us and shuts its pool down once `limit` is reached
+    concepts = stream_concepts(dump_path, qids=qids, props=props, prop_labels=labels.table,
+                               workers=workers, limit=limit)
+    for concept in tqdm(concepts, desc="Entities"):
+        node_ids.setdefault(concept['id'], len(node_ids))
+        batch.append(concept)
+        if len(batch) == BATCH_SIZE:
+            flush(batch)
+            batch = []
+    if batch: flush(batch)
+
+    duration = time.time() - start_time
+    print(f"Processed {len(meta_for_indexing)} entities in {duration:.2f}s")
+
+    print("Building Search Indexes...")
+    indexer.build_indexes(meta_for_indexing)
+    print("✅ Dump Ingestion Complete. Run pack_crs.py next.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a Wikidata JSON dump (bz2/gz) into CRS.")
+    parser.add_argument("dump", help="latest-all.json.bz2 / .gz / plain JSON lines")
+    parser.add_argument("--ids", help="file with one Q-id per line to keep (default: all items)")
+    parser.add_argument("--props", help="comma-separated P-codes to keep (default: all)")
+    parser.add_argument("--labels", help="property label file (TSV or property-entity JSON lines)")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    ingest_dump(args.dump, ids_path=args.ids, props=args.props.split(',') if args.props else None,
+                labels_path=args.labels, limit=args.limit, workers=args.workers)
@@ -1,33 +1,35 @@
-import lmdb
-import glob
-import os
-import struct
+import time
 from tqdm import tqdm
+from src.storage import Storage, pack_sidecars, concept_files, read_files
 
 
 def pack_to_lmdb():
     print("--- 📦 Packing CRS to LMDB ---")
 
-    # 1. Setup LMDB (Map size = 1GB is enough for WordNet, using 2GB to be safe)
-    os.makedirs("data/storage", exist_ok=True)
-    env = lmdb.open("data/storage", map_size=2 * 1024 * 1024 * 1024)
+    # 1. Setup LMDB: the shared storage environment (grows on demand); no fsync per commit while bulk loading
+    storage = Storage("data/storage", sync='nosync')
 
-    # 2. Get all files
-    files = glob.glob("data/concepts/*.bin")
+    # 2. Get all files, sorted by key: LMDB can then append pages sequentially instead of inserting at random
+    files = concept_files("data/concepts")
     print(f"Found {len(files)} files to pack.")
 
-    # 3. Write to DB
-    with env.begin(write=True) as txn:
-        for filepath in tqdm(files):
-            # Extract ID from filename (e.g., "data/concepts\wn_12345n.bin" -> "wn_12345n")
-            filename = os.path.basename(filepath)
-            cid = os.path.splitext(filename)[0]
-
-            with open(filepath, 'rb') as f:
-                data = f.read()
-
-            # Store: Key=ID, Value=BinaryData
-            txn.put(cid.encode('ascii'), data)
+    # 3. Write to the `concepts` sub-db in bounded commits (re-runs overwrite instead of appending)
+    with tqdm(total=len(files)) as progress:
+        st = storage.bulk_load('concepts', read_files(files, progress))
+    secs = max(st['seconds'], 1e-9)
+    print(f"Packed {st['items']} concepts ({st['bytes'] / 1e6:.1f} MB) in {secs:.2f}s: "
+          f"{st['items'] / secs:,.0f} records/s, {st['bytes'] / 1e6 / secs:.1f} MB/s "
+          f"({st['appended']} appended, {st['items'] - st['appended']} overwritten)")
+
+    # 4. Embedding sidecars -> `embeddings` sub-db (float16, outside the concept records)
+    embs = pack_sidecars(storage, "data/concepts")
+    print(f"Packed {len(embs)} embeddings.")
+
+    storage.put_meta('pack', {'concepts': len(files), 'embeddings': len(embs), 'time': time.time()})
+    storage.sync()
+    for name, st in storage.stats()['dbs'].items():
+        print(f"   {name:14s} {st['entries']:>9} entries  {st['bytes'] / 1e6:8.1f} MB  depth {st['depth']}")
+    storage.close()
 
     print("✅ Packing Complete. You can now delete 'data/concepts/' folder.")
 
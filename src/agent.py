@@ -3,41 +3,58 @@ import os
 import json
 import numpy as np
 import faiss
-import wikipedia
 import re
+import requests
 import trafilatura
-import glob
-import lmdb
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from duckduckgo_search import DDGS
-from scipy import sparse
+from src.graph import RelationInterner, build_csr, save_csr
 from src.query_engine import CRS
 from src.embedders import MultimodalEmbedder
-from src.wikidata import WikidataFetcher
+from src.wikidata import WikidataFetcher, WIKIDATA_API
 from src.builder import ConceptBuilder
+from src.storage import pack_sidecars, concept_files, read_files
+
+WIKIPEDIA_API = "https://en.wikipedia.org/w/api.php"
 
 
 class LearningAgent:
-    def __init__(self, root="data"):
+    def __init__(self, root="data", wikidata_endpoint=WIKIDATA_API, offline=False,
+                 wikipedia_endpoint=WIKIPEDIA_API, web_search=None):
         print("🤖 Agent waking up... (Loading Memory)")
         self.root = root
-        self.crs = CRS(root)
+        self.crs = CRS(root, readonly=False)
         self.embedder = MultimodalEmbedder()
-        self.wiki = WikidataFetcher()
-        self.builder = ConceptBuilder(output_dir=f"{root}/concepts")
+        self.wiki = WikidataFetcher(endpoint=wikidata_endpoint, offline=offline,
+                                    cache_path=f"{root}/metadata/wikidata_cache.sqlite")
+        # Every source is a plain HTTP call with its own timeout (and pointable at a local stub):
+        # a hung server fails that source instead of pinning a fetch_pool thread forever
+        self.wikipedia_endpoint = wikipedia_endpoint
+        self.web_search = web_search or self.search_ddg  # query -> [{'href', 'body'}]
+        self.http = requests.Session()
+        self.http.headers.update(self.wiki.headers)
+        # Relations are stored as node ids / codes, sharing the CRS node map and type table
+        self.builder = ConceptBuilder(output_dir=f"{root}/concepts",
+                                      interner=RelationInterner(root, self.crs.node_map, self.crs.rel_types))
 
         self.UNKNOWN_THRESHOLD = 0.85
+        # Vector hits within the threshold are re-ranked with graph signals against recent answers
+        self.RERANK_CANDIDATES = 8
+        self.context = deque(maxlen=8)
         self.items_learned_session = 0
         self.MAINTENANCE_TRIGGER = 5
-        self.label_index_path = f"{root}/metadata/label_index.json"
-        self.label_index = self._load_label_index()
-
-    def _load_label_index(self):
-        if os.path.exists(self.label_index_path):
-            with open(self.label_index_path, 'r') as f: return json.load(f)
-        return {}
-
-    def _save_label_index(self):
-        with open(self.label_index_path, 'w') as f: json.dump(self.label_index, f)
+        self.GRAPH_COMPACT_EDGES = 50_000  # fold the graph delta into the CSR beyond this many edges
+        # Network sources are queried in parallel; learn latency ~ max(sources), capped here
+        self.FETCH_TIMEOUT = 10.0
+        self.SOURCE_TIMEOUT = (3.05, self.FETCH_TIMEOUT)  # (connect, read) per HTTP call
+        self.fetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="crs-fetch")
+        self.label_index = self.crs.labels
+        # One-off migration from the old JSON label dict
+        old_index = f"{root}/metadata/label_index.json"
+        if os.path.exists(old_index):
+            self.label_index.import_json(old_index)
+            os.replace(old_index, old_index + ".migrated")
 
     def extract_subject(self, sentence):
         patterns = [
@@ -48,16 +65,19 @@ class LearningAgent:
         for p in patterns: clean_q = re.sub(p, "", clean_q, flags=re.IGNORECASE)
         return clean_q.replace('?', '').replace('!', '').strip()
 
+    def search_ddg(self, query):
+        return DDGS(timeout=self.SOURCE_TIMEOUT[1]).text(query, max_results=1)
+
     def get_web_data(self, query):
         try:
-            results = DDGS().text(query, max_results=1)
+            results = self.web_search(query)
             if not results: return None, None
             top_hit = results[0]
             url = top_hit['href']
             print(f"   🔗 Crawling URL: {url}")
-            downloaded = trafilatura.fetch_url(url)
-            if downloaded:
-                text = trafilatura.extract(downloaded)
+            r = self.http.get(url, timeout=self.SOURCE_TIMEOUT)
+            if r.ok:
+                text = trafilatura.extract(r.text)
                 if text: return text[:600] + "...", url
             return top_hit['body'], url
         except Exception as e:
@@ -70,63 +90,145 @@ class LearningAgent:
         print(f"\n🤔 Query: '{user_query}' -> Subject: '{search_term}'")
 
         # 1. Symbolic Search
-        if not is_news and clean_key in self.label_index:
-            cid = self.label_index[clean_key]
+        cid = None if is_news else self.label_index.get(clean_key)
+        if cid:
             print(f"   📖 Found in Symbolic Index (ID: {cid}).")
             concept = self.crs.get_concept(cid)
-            if concept: return self.format_concept(concept)
+            if concept: return self.answer(cid, concept)
+
+        # 1b. Typo / plural tolerant label match. A plural is an exact hit (no embedding needed); a typo
+        # match must also be close in vector space, or a new name one edit from a known label
+        # ("claude" / "clause") would get that concept's answer and never be learned.
+        match = None if is_news else self.label_index.fuzzy(clean_key)
+        query_vec = None
+        if match:
+            cid, label, dist = match
+            if dist > 0:
+                query_vec = self.embedder.embed_text(search_term)
+                if not self.is_close(cid, query_vec):
+                    print(f"   🔤 '{label}' is a near spelling but not semantically close; searching instead.")
+                    match = None
+        if match:
+            print(f"   🔤 Fuzzy label match '{label}' (edit distance {dist}, ID: {cid}).")
+            concept = self.crs.get_concept(cid)
+            if concept: return self.answer(cid, concept)
 
         # 2. Vector Search
-        query_vec = self.embedder.embed_text(search_term)
+        if query_vec is None: query_vec = self.embedder.embed_text(search_term)
         if not query_vec: return "Error."
-        D, I = self.crs.index.search(np.array([query_vec]).astype('float32'), k=1)
+        hits = self.crs.search_hits([query_vec], k=self.RERANK_CANDIDATES)[0]
 
-        best_idx = I[0][0]
-        distance = D[0][0]
+        distance = hits[0][1] if hits else float('inf')
         print(f"   Internal Memory Distance: {distance:.4f}")
 
         # 3. Decision
-        if is_news or best_idx == -1 or distance > self.UNKNOWN_THRESHOLD:
+        if is_news or not hits or distance > self.UNKNOWN_THRESHOLD:
             print(f"   🌑 Unknown or News requested.")
             new_cid = self.learn_concept(search_term, force_web=is_news)
             if new_cid:
                 self.check_maintenance()
-                return self.format_concept(self.crs.get_concept(new_cid))
+                return self.answer(new_cid, self.crs.get_concept(new_cid))
             return "❌ Could not find info."
 
-        return self.format_concept(self.crs.get_concept(self.crs.faiss_map[best_idx]))
+        # 4. Among the close enough hits, prefer the one that fits the conversation's graph neighbourhood
+        close = [h for h in hits if h[1] <= self.UNKNOWN_THRESHOLD]
+        cid = self.crs.rerank(close, context=list(self.context))[0][0]
+        return self.answer(cid, self.crs.get_concept(cid))
 
-    def learn_concept(self, query, force_web=False):
+    def is_close(self, cid, query_vec):
+        """Same test as the vector path: squared L2 to the concept's text embedding within UNKNOWN_THRESHOLD."""
+        emb = self.crs.get_embedding(cid) if query_vec else None
+        if emb is None: return False
+        return float(np.sum((np.asarray(query_vec, dtype=np.float32) - emb) ** 2)) <= self.UNKNOWN_THRESHOLD
+
+    def answer(self, cid, concept):
+        self.context.append(cid)
+        return self.format_concept(concept)
+
+    def fetch_wikidata(self, query):
         qid = self.wiki.search_entity(query)
+        if not qid: return None
+        description, _, props, rels = self.wiki.get_details(qid)
+        return qid, description, props, rels
+
+    def fetch_wikipedia(self, query):
+        # Intro of the best search hit, first 3 sentences (one API call, same text as wikipedia.summary)
+        params = {'action': 'query', 'format': 'json', 'generator': 'search', 'gsrsearch': query,
+                  'gsrlimit': 1, 'prop': 'extracts', 'exintro': 1, 'explaintext': 1, 'exsentences': 3,
+                  'redirects': 1}
+        try:
+            r = self.http.get(self.wikipedia_endpoint, params=params, timeout=self.SOURCE_TIMEOUT)
+            r.raise_for_status()
+            pages = r.json().get('query', {}).get('pages', {})
+            return next((p['extract'] for p in pages.values() if p.get('extract')), None)
+        except Exception:
+            return None
+
+    def gather_sources(self, query, force_web=False):
+        """
+        Fires Wikidata, Wikipedia and Web lookups concurrently.
+        Returns {source: result} for every source that answered within FETCH_TIMEOUT.
+        Stops early once Wikidata (ids/props) and the best-ranked definition source are in.
+        """
+        futures = {
+            'wikidata': self.fetch_pool.submit(self.fetch_wikidata, query),
+            'web': self.fetch_pool.submit(self.get_web_data, query),
+        }
+        if not force_web:
+            futures['wikipedia'] = self.fetch_pool.submit(self.fetch_wikipedia, query)
+
+        results = {}
+        pending = set(futures.values())
+        deadline = time.time() + self.FETCH_TIMEOUT
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                print(f"   ⏱️ Timed out waiting for: {[n for n, f in futures.items() if f in pending]}")
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for name, fut in futures.items():
+                if fut in done:
+                    try:
+                        results[name] = fut.result()
+                    except Exception:
+                        results[name] = None
+            if 'wikidata' in results and self._pick_definition(results, futures) is not None:
+                break
+        return results
+
+    @staticmethod
+    def _pick_definition(results, expected):
+        # Same preference as before: Wikipedia > Web > Wikidata description.
+        # Returns None while a better-ranked source is still in flight.
+        for name in ('wikipedia', 'web', 'wikidata'):
+            if name not in expected: continue
+            if name not in results: return None
+            res = results[name]
+            if name == 'wikipedia' and res:
+                return res, {'source_type': 'wikipedia', 'url': 'wikipedia.org', 'snippet': res[:100]}
+            if name == 'web' and res and res[0]:
+                return res[0], {'source_type': 'web', 'url': res[1], 'snippet': res[0][:100]}
+            if name == 'wikidata' and res:
+                qid, desc = res[0], res[1]
+                return desc, {'source_type': 'wikidata', 'url': f"wikidata.org/wiki/{qid}", 'snippet': 'Description'}
+        return "", None
+
+    def learn_concept(self, query, force_web=False):
+        results = self.gather_sources(query, force_web)
+        wiki_res = results.get('wikidata')
+        qid = wiki_res[0] if wiki_res else None
         props, rels, aliases = [], [], []
 
         if qid:
             print(f"   🔗 Linking to Wikidata ID: {qid}")
-            _, _, wiki_props, wiki_rels = self.wiki.get_details(qid)
+            _, _, wiki_props, wiki_rels = wiki_res
             props.extend(wiki_props)
             rels.extend(wiki_rels)
             aliases.append(query)
 
-        evidence = []
-        final_text = ""
-
-        if not force_web:
-            try:
-                final_text = wikipedia.summary(query, sentences=3)
-                evidence.append({'source_type': 'wikipedia', 'url': 'wikipedia.org', 'snippet': final_text[:100]})
-            except:
-                pass
-
-        if not final_text:
-            web_text, url = self.get_web_data(query)
-            if web_text:
-                final_text = web_text
-                evidence.append({'source_type': 'web', 'url': url, 'snippet': web_text[:100]})
-
-        if not final_text and qid:
-            wiki_desc, _, _, _ = self.wiki.get_details(qid)
-            final_text = wiki_desc
-            evidence.append({'source_type': 'wikidata', 'url': f"wikidata.org/wiki/{qid}", 'snippet': 'Description'})
+        # Timed-out sources count as missing: take the best definition that did arrive
+        final_text, ev = self._pick_definition(results, expected=results)
+        evidence = [ev] if ev else []
 
         if not final_text: return None
 
@@ -144,18 +246,20 @@ class LearningAgent:
             'evidence': evidence
         }
 
+        self.crs.add_graph_node(concept_id, rels)  # first, so the record can reference its node id
+        # ...and on disk before the record is: an unsaved id would be handed out again after a restart
+        self.crs.save_graph_delta()
         self.builder.build_concept(concept_data)
+        self.crs.add_properties(concept_id, props)
 
         self.crs.index.add(np.array([text_emb]).astype('float32'))
         self.crs.faiss_map[self.crs.index.ntotal - 1] = concept_data['id']
 
-        self.label_index[query.lower()] = concept_id
-        for alias in aliases: self.label_index[alias.lower()] = concept_id
-        self._save_label_index()
+        self.label_index.add_many([(query, concept_id)] + [(alias, concept_id) for alias in aliases])
 
         faiss.write_index(self.crs.index, f"{self.root}/vectors/text.faiss")
-        with open(f"{self.root}/metadata/faiss_id_map.json", 'w') as f:
-            json.dump(self.crs.faiss_map, f)
+        # One key in the `id_maps` sub-db instead of rewriting the whole JSON map
+        self.crs.storage.put_id_map('text', {self.crs.index.ntotal - 1: concept_id})
 
         return concept_data['id']
 
@@ -172,53 +276,64 @@ class LearningAgent:
     def check_maintenance(self):
         self.items_learned_session += 1
         if self.items_learned_session >= self.MAINTENANCE_TRIGGER:
-            print(f"\n   🛠️ MAINTENANCE: Rebuilding Graph & Packing LMDB...")
-            self.rebuild_graph()
+            print(f"\n   🛠️ MAINTENANCE: Saving Graph Delta, Flushing Properties & Packing LMDB...")
+            self.crs.save_graph_delta()
+            if len(self.crs.graph_delta) >= self.GRAPH_COMPACT_EDGES:
+                self.crs.compact_graph()
+            self.crs.flush_properties()
             self.pack_memory()
             self.items_learned_session = 0
 
     def rebuild_graph(self):
-        all_ids = list(self.crs.faiss_map.values())
-        id_to_int = {cid: i for i, cid in enumerate(all_ids)}
-        row_ind, col_ind, data_val = [], [], []
-
-        for cid in all_ids:
+        """Full rescan of every stored concept (the incremental delta makes this a repair tool)."""
+        # Node ids are stable (records store them in Relation.target): keep the map, append unseen concepts
+        id_to_int = dict(self.crs.node_map)
+        for cid in self.crs.faiss_map.values(): id_to_int.setdefault(cid, len(id_to_int))
+        rel_types = self.crs.rel_types
+        delta = self.crs.graph_delta
+        delta.clear(keep_pending=False)  # every node lands in the new CSR; pending edges are re-derived
+        row_ind, col_ind, data_val, type_val = [], [], [], []
+
+        for cid, u in id_to_int.items():
             c = self.crs.get_concept(cid)
             if not c: continue
-            u = id_to_int[cid]
             rels_len = c.RelationsLength()
             for i in range(rels_len):
                 r = c.Relations(i)
-                target = r.TargetId().decode('utf-8')
-                if target in id_to_int:
-                    v = id_to_int[target]
-                    row_ind.append(u)
-                    col_ind.append(v)
-                    data_val.append(1)
-
-        size = len(all_ids)
-        adj_matrix = sparse.csr_matrix((data_val, (row_ind, col_ind)), shape=(size, size))
-        np.savez(f"{self.root}/graph/csr_arrays.npz", indptr=adj_matrix.indptr, indices=adj_matrix.indices,
-                 data=adj_matrix.data)
+                # Interned records: ints only; older records: strings
+                t = r.TypeCode() if r.Type() is None else rel_types.code(r.Type().decode('utf-8'))
+                v = r.Target()
+                if v < 0:
+                    target = r.TargetId().decode('utf-8')
+                    v = id_to_int.get(target, -1)
+                    if v < 0:
+                        delta.add_pending(target, u, r.Confidence(), t)
+                        continue
+                row_ind.append(u)
+                col_ind.append(v)
+                data_val.append(r.Confidence())
+                type_val.append(t)
+
+        size = len(id_to_int)
+        arrays = build_csr(row_ind, col_ind, size, data_val, type_val)
+        save_csr(f"{self.root}/graph/csr_arrays.npz", arrays)
+        rel_types.save(f"{self.root}/graph/rel_types.json")
         with open(f"{self.root}/graph/node_map.json", 'w') as f:
             json.dump(id_to_int, f)
-        self.crs.graph = adj_matrix
-        self.crs.node_map = id_to_int
-        self.crs.rev_node_map = {v: k for k, v in id_to_int.items()}
+        self.crs.set_graph(arrays, id_to_int)
+        self.builder.interner.node_ids = self.crs.node_map
+        self.crs.save_graph_delta()
+        self.crs.refresh_analytics()
 
     def pack_memory(self):
-        # Open with 2GB limit, but file will only grow as needed on Linux/Mac.
-        # On Windows it pre-allocates, so we might want to compact later.
-        env = lmdb.open(f"{self.root}/storage", map_size=2 * 1024 * 1024 * 1024)
-        files = glob.glob(f"{self.root}/concepts/*.bin")
+        # Same environment CRS reads from (LMDB allows one handle per process); it grows on demand.
+        storage = self.crs.storage
+        keyed = concept_files(f"{self.root}/concepts")
 
-        if not files: return
+        if not keyed: return
 
-        with env.begin(write=True) as txn:
-            for filepath in files:
-                cid = os.path.basename(filepath).replace('.bin', '')
-                with open(filepath, 'rb') as f: data = f.read()
-                txn.put(cid.encode('ascii'), data)
+        storage.bulk_load('concepts', read_files(keyed))
+        files = [path for _, path in keyed] + pack_sidecars(storage, f"{self.root}/concepts")
 
         # Cleanup loose files after packing
         for filepath in files:
@@ -236,5 +351,8 @@ if __name__ == "__main__":
     print("Welcome to Stage 2.5 (Evidence + Packing).")
     while True:
         q = input("\nUser> ")
-        if q.lower() == 'q': break
+        if q.lower() == 'q':
+            agent.crs.save_graph_delta()
+            agent.crs.flush_properties()
+            break
         print(f"Agent> {agent.ask(q)}")
\ No newline at end of file
@@ -0,0 +1,94 @@
+import faiss
+import numpy as np
+
+# Set bits per byte value, for popcount without unpacking
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class IdBitmap:
+    """
+    Fixed-size bitset over the integer concept id space (FAISS row == graph node id).
+    Bits are packed little-endian into uint8, which is also the layout faiss.IDSelectorBitmap reads,
+    so a bitmap can be handed to a filtered vector search without conversion.
+    """
+    __slots__ = ('bits', 'size')
+
+    def __init__(self, size, bits=None):
+        self.size = size
+        nbytes = (size + 7) // 8
+        self.bits = np.zeros(nbytes, dtype=np.uint8) if bits is None else bits
+
+    @classmethod
+    def from_mask(cls, mask):
+        return cls(len(mask), np.packbits(np.asarray(mask, dtype=bool), bitorder='little'))
+
+    @classmethod
+    def from_ids(cls, ids, size):
+        mask = np.zeros(size, dtype=bool)
+        ids = np.asarray(ids, dtype=np.int64)
+        mask[ids[(ids >= 0) & (ids < size)]] = True
+        return cls.from_mask(mask)
+
+    def to_mask(self):
+        return np.unpackbits(self.bits, count=self.size, bitorder='little').astype(bool)
+
+    def to_ids(self):
+        return np.flatnonzero(self.to_mask())
+
+    def resize(self, size):
+        """Same bits in a larger (zero-padded) or smaller id space."""
+        if size == self.size: return self
+        nbytes = (size + 7) // 8
+        bits = np.zeros(nbytes, dtype=np.uint8)
+        n = min(nbytes, len(self.bits))
+        bits[:n] = self.bits[:n]
+        out = IdBitmap(size, bits)
+        if size < self.size: out._clear_tail()
+        return out
+
+    def _clear_tail(self):
+        if self.size % 8:
+            self.bits[-1] &= (1 << (self.size % 8)) - 1
+        return self
+
+    def _aligned(self, other):
+        size = max(self.size, other.size)
+        return self.resize(size).bits, other.resize(size).bits, size
+
+    def __and__(self, other):
+        a, b, size = self._aligned(other)
+        return IdBitmap(size, a & b)
+
+    def __or__(self, other):
+        a, b, size = self._aligned(other)
+        return IdBitmap(size, a | b)
+
+    def __sub__(self, other):
+        a, b, size = self._aligned(other)
+        return IdBitmap(size, a & ~b)
+
+    def __invert__(self):
+        return IdBitmap(self.size, ~self.bits)._clear_tail()
+
+    def __len__(self):
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def __contains__(self, i):
+        return 0 <= i < self.size and bool(self.bits[i >> 3] & (1 << (i & 7)))
+
+    def selector(self):
+        """faiss.IDSelectorBitmap over these bits (keeps a reference so the buffer outlives the search)."""
+        # n is the bitmap length in bytes: ids at or past 8 * n are never selected (or read)
+        sel = faiss.IDSelectorBitmap(len(self.bits), faiss.swig_ptr(self.bits))
+        sel.referenced_bits = self.bits
+        return sel
+
+
+def save_bitmaps(path, bitmaps, size):
+    np.savez(path, __size__=np.array([size]), **{name: bm.bits for name, bm in bitmaps.items()})
+
+
+def load_bitmaps(path):
+    loader = np.load(path)
+    size = int(loader['__size__'][0])
+    return {name: IdBitmap(size, loader[name]) for name in loader.files if name != '__size__'}
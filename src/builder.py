@@ -10,6 +10,7 @@ import crs.Embedding as E
 import crs.Relation as R
 import crs.Property as P
 import crs.Evidence as Ev  # <--- NEW: Import Evidence
+from src.storage import EMBEDDING_DTYPE, write_sidecars
 
 try:
     wn.all_synsets()
@@ -18,9 +19,20 @@ except LookupError:
 
 
 class ConceptBuilder:
-    def __init__(self, output_dir="data/concepts"):
+    def __init__(self, output_dir="data/concepts", inline_embeddings=False, embedding_dtype=EMBEDDING_DTYPE,
+                 interner=None):
+        """
+        inline_embeddings=False (default) keeps vectors out of the Concept record: they go to
+        <id>.<modality>.emb sidecars (float16 unless embedding_dtype says otherwise), which the packers
+        move into the LMDB `embeddings` sub-db. Records then hold only what get_concept displays.
+        interner: optional RelationInterner; relations are then written as node ids / type & source codes
+        instead of strings (unknown targets keep their target_id string).
+        """
         self.builder = flatbuffers.Builder(1024)
         self.output_dir = output_dir
+        self.inline_embeddings = inline_embeddings
+        self.embedding_dtype = embedding_dtype
+        self.interner = interner
         os.makedirs(output_dir, exist_ok=True)
 
     def _create_string(self, s):
@@ -53,15 +65,20 @@ class ConceptBuilder:
         if not rels: return None
         offsets = []
         for r in rels:
-            type_off = self._create_string(r['type'])
-            tid_off = self._create_string(r['target_id'])
-            src_off = self._create_string(r['source'])
+            target, type_code, source_code = self.interner.encode(r) if self.interner else (-1, None, None)
+            type_off = self._create_string(r['type']) if type_code is None else None
+            tid_off = self._create_string(r['target_id']) if target < 0 else None
+            src_off = self._create_string(r['source']) if source_code is None else None
             R.Start(self.builder)
-            R.AddType(self.builder, type_off)
-            R.AddTargetId(self.builder, tid_off)
-            R.AddSource(self.builder, src_off)
+            if type_off: R.AddType(self.builder, type_off)
+            if tid_off: R.AddTargetId(self.builder, tid_off)
+            if src_off: R.AddSource(self.builder, src_off)
             R.AddConfidence(self.builder, r.get('confidence', 1.0))
+            if target >= 0: R.AddTarget(self.builder, target)
+            if type_code is not None: R.AddTypeCode(self.builder, type_code)
+            if source_code is not None: R.AddSourceCode(self.builder, source_code)
             offsets.append(R.End(self.builder))
+        if self.interner: self.interner.save()
         C.StartRelationsVector(self.builder, len(offsets))
         for o in reversed(offsets): self.builder.PrependUOffsetTRelative(o)
         return self.builder.EndVector()
@@ -110,7 +127,12 @@ class ConceptBuilder:
         # New: Aliases
         alias_off = self._create_vector(data.get('aliases', []), C.StartAliasesVector)
 
-        txt_emb = self._create_embedding(data.get('text_embedding'))
+        txt_emb = img_emb = None
+        if self.inline_embeddings:
+            txt_emb = self._create_embedding(data.get('text_embedding'))
+            img_emb = self._create_embedding(data.get('image_embedding'))
+        else:
+            write_sidecars(self.output_dir, data, self.embedding_dtype)
         rels_off = self._create_relations(data.get('relations', []))
         props_off = self._create_properties(data.get('properties', []))
         ev_off = self._create_evidence(data.get('evidence', []))  # <--- NEW
@@ -121,6 +143,7 @@ class ConceptBuilder:
         C.AddDefinition(self.builder, def_off)
         if alias_off: C.AddAliases(self.builder, alias_off)
         if txt_emb: C.AddTextEmbedding(self.builder, txt_emb)
+        if img_emb: C.AddImageEmbedding(self.builder, img_emb)
         if rels_off: C.AddRelations(self.builder, rels_off)
         if props_off: C.AddProperties(self.builder, props_off)
         if ev_off: C.AddEvidence(self.builder, ev_off)  # <--- NEW
@@ -0,0 +1,66 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    Persistent key -> JSON cache (SQLite) with per-entry expiry.
+    A stored value of None is a negative entry ("we asked, there was nothing").
+    Safe to share between the agent's fetch threads.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+        self.con.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns (found, value). Expired entries count as not found."""
+        return self.get_many([key]).get(key, (False, None))
+
+    def get_many(self, keys):
+        out = {}
+        if not keys: return out
+        now = time.time()
+        with self.lock:
+            for i in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+                chunk = keys[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self.con.execute(
+                    f"SELECT key, value FROM responses WHERE key IN ({marks}) AND expires > ?", chunk + [now]
+                ).fetchall()
+                for key, value in rows:
+                    out[key] = (True, json.loads(value) if value is not None else None)
+            self.hits += len(out)
+            self.misses += len(keys) - len(out)
+        return out
+
+    def put(self, key, value, ttl):
+        self.put_many({key: value}, ttl)
+
+    def put_many(self, items, ttl):
+        if not items: return
+        expires = time.time() + ttl
+        rows = [(k, json.dumps(v) if v is not None else None, expires) for k, v in items.items()]
+        with self.lock:
+            self.con.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", rows)
+            self.con.commit()
+
+    def purge_expired(self):
+        with self.lock:
+            self.con.execute("DELETE FROM responses WHERE expires <= ?", [time.time()])
+            self.con.commit()
+
+    def close(self):
+        with self.lock:
+            self.con.close()
@@ -1,8 +1,10 @@
+import os
 import torch
 from sentence_transformers import SentenceTransformer
 import open_clip
 from PIL import Image
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 
 class MultimodalEmbedder:
@@ -16,6 +18,7 @@ class MultimodalEmbedder:
         print(f"Loading Image Model on {self.device}...")
         self.clip_model, _, self.clip_preprocess = open_clip.create_model_and_transforms('ViT-B-32',
                                                                                          pretrained='laion2b_s34b_b79k')
+        self.clip_tokenizer = open_clip.get_tokenizer('ViT-B-32')
         if self.device == 'cuda':
             self.clip_model.cuda()
         self.clip_model.eval()
@@ -31,14 +34,63 @@ class MultimodalEmbedder:
         if not text: return None
         return self.embed_text_batch([text])[0]
 
+    def embed_clip_text_batch(self, texts):
+        # CLIP text tower: lives in the same space as embed_image (for text -> image search)
+        if not texts: return []
+        tokens = self.clip_tokenizer(texts)
+        if self.device == 'cuda':
+            tokens = tokens.cuda()
+        with torch.no_grad():
+            embs = self.clip_model.encode_text(tokens)
+        return embs.cpu().numpy().tolist()
+
+    def embed_clip_text(self, text):
+        if not text: return None
+        return self.embed_clip_text_batch([text])[0]
+
+    def _load_image(self, image_path):
+        # Runs on the decode pool: PIL decode + CLIP preprocessing (resize/crop/normalize)
+        try:
+            with Image.open(image_path) as img:
+                return self.clip_preprocess(img.convert('RGB'))
+        except Exception:
+            return None
+
+    def embed_image_batch(self, image_paths, batch_size=32, workers=None):
+        """
+        Embeds many images with CLIP.
+        Decoding runs on a thread pool (PIL releases the GIL while decoding),
+        while the model runs on the previously decoded batch.
+        Returns a list aligned with image_paths (None for unreadable images).
+        """
+        if not image_paths: return []
+        results = [None] * len(image_paths)
+        workers = workers or min(8, (os.cpu_count() or 1) + 4)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Keep one batch decoding ahead of the model (bounded memory for big collections)
+            starts = range(0, len(image_paths), batch_size)
+            pending = None
+            for start in starts:
+                chunk = image_paths[start:start + batch_size]
+                futures = [pool.submit(self._load_image, p) for p in chunk]
+                if pending: self._encode_image_batch(*pending, results)
+                tensors = [f.result() for f in futures]
+                batch_idx = [start + i for i, t in enumerate(tensors) if t is not None]
+                batch = [t for t in tensors if t is not None]
+                pending = (batch, batch_idx) if batch else None
+            if pending: self._encode_image_batch(*pending, results)
+        return results
+
+    def _encode_image_batch(self, batch, batch_idx, results):
+        images = torch.stack(batch)
+        if self.device == 'cuda':
+            images = images.cuda(non_blocking=True)
+        with torch.no_grad():
+            embs = self.clip_model.encode_image(images).cpu().numpy()
+        for i, emb in zip(batch_idx, embs):
+            results[i] = emb.tolist()
+
     def embed_image(self, image_path):
         if not image_path: return None
-        try:
-            image = self.clip_preprocess(Image.open(image_path)).unsqueeze(0)
-            if self.device == 'cuda':
-                image = image.cuda()
-            with torch.no_grad():
-                emb = self.clip_model.encode_image(image)
-            return emb.cpu().numpy()[0].tolist()
-        except:
-            return None
\ No newline at end of file
+        return self.embed_image_batch([image_path], workers=1)[0]
@@ -0,0 +1,471 @@
+import json
+import os
+import struct
+import numpy as np
+from scipy import sparse
+
+
+# Relation types meaning "x is a kind / an instance of y" (WordNet + Wikidata labels)
+HYPERNYM_TYPES = ('is_a', 'instance of', 'subclass of')
+
+
+class RelationTypes:
+    """String table for relation types ('is_a' <-> 0, ...), stored next to the CSR arrays."""
+
+    def __init__(self, names=None):
+        self.names = list(names or [])
+        self.codes = {n: i for i, n in enumerate(self.names)}
+
+    def code(self, name):
+        if name not in self.codes:
+            self.codes[name] = len(self.names)
+            self.names.append(name)
+        return self.codes[name]
+
+    def lookup(self, names):
+        """Codes for the given names (unknown names are dropped)."""
+        return [self.codes[n] for n in names if n in self.codes]
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path): return cls()
+        with open(path) as f: return cls(json.load(f))
+
+    def save(self, path):
+        with open(path, 'w') as f: json.dump(self.names, f)
+
+
+class RelationInterner:
+    """
+    Integer form of Concept.Relation fields: target -> graph node id, type / source -> small codes.
+    The type and source tables are append-only files in <root>/graph, so codes written into records
+    stay valid for the indexer, CRS and later rebuilds. Targets without a node id keep their string.
+    Callers must persist node_ids (node_map.json / the graph delta) before the records they encode.
+    """
+    MAX_TYPE, MAX_SOURCE = 0xFFFF, 0xFF  # ushort / ubyte in the schema
+
+    def __init__(self, root="data", node_ids=None, types=None):
+        self.root = root
+        self.node_ids = node_ids if node_ids is not None else {}  # concept id -> node id, filled by the caller
+        self.types = types or RelationTypes.load(f"{root}/graph/rel_types.json")
+        self.sources = RelationTypes.load(f"{root}/graph/rel_sources.json")
+        self._sizes = (len(self.types.names), len(self.sources.names))
+
+    def encode(self, r):
+        """(target node id or -1, type code or None, source code or None) for a relation dict."""
+        t = self.types.code(r['type'])
+        s = self.sources.code(r.get('source') or '')
+        return (self.node_ids.get(r['target_id'], -1),
+                t if t <= self.MAX_TYPE else None, s if s <= self.MAX_SOURCE else None)
+
+    def decode(self, r, rev_node_map):
+        """Concept.Relation -> {type, target_id, source, confidence}, whichever form it was written in."""
+        target = r.Target()
+        return {'type': r.Type().decode('utf-8') if r.Type() is not None else self.types.names[r.TypeCode()],
+                'target_id': r.TargetId().decode('utf-8') if target < 0 else rev_node_map[target],
+                'source': r.Source().decode('utf-8') if r.Source() is not None else self.sources.names[r.SourceCode()],
+                'confidence': r.Confidence()}
+
+    def save(self):
+        """Persists the tables if a new type/source appeared since the last save."""
+        sizes = (len(self.types.names), len(self.sources.names))
+        if sizes == self._sizes: return
+        os.makedirs(f"{self.root}/graph", exist_ok=True)
+        self.types.save(f"{self.root}/graph/rel_types.json")
+        self.sources.save(f"{self.root}/graph/rel_sources.json")
+        self._sizes = sizes
+
+
+def build_csr(rows, cols, size, weights=None, types=None):
+    """
+    COO edge lists -> CSR arrays (indptr, indices, data, types), rows in order, parallel edges kept.
+    Unlike scipy's constructor this keeps `types` aligned with `indices`.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int32)
+    weights = np.ones(len(rows), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+    types = np.zeros(len(rows), dtype=np.int32) if types is None else np.asarray(types, dtype=np.int32)
+
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return {'indptr': indptr, 'indices': cols[order], 'data': weights[order], 'types': types[order]}
+
+
+def save_csr(path, arrays):
+    np.savez(path, **arrays)
+
+
+def load_csr(path):
+    loader = np.load(path)
+    arrays = {k: loader[k] for k in loader.files}
+    if 'types' not in arrays:  # graphs built before relation types were recorded
+        arrays['types'] = np.zeros(len(arrays['indices']), dtype=np.int32)
+    return arrays
+
+
+def to_scipy(arrays, size=None):
+    size = size or len(arrays['indptr']) - 1
+    return sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=(size, size))
+
+
+def reverse_csr(arrays):
+    """Transposed adjacency (incoming edges), with data/types carried along."""
+    indptr, indices = arrays['indptr'], arrays['indices']
+    size = len(indptr) - 1
+    rows = np.repeat(np.arange(size, dtype=np.int64), np.diff(indptr))
+    return build_csr(indices, rows, size, arrays['data'], arrays['types'])
+
+
+def gather(arrays, nodes, allowed_types=None):
+    """
+    Vectorised neighbour expansion of a node frontier.
+    Returns (sources, targets, edge positions) for every outgoing edge of `nodes`.
+    Nodes newer than this CSR (id >= its size) simply have no edges here.
+    """
+    indptr = arrays['indptr']
+    nodes = np.asarray(nodes, dtype=np.int64)
+    nodes = nodes[nodes < len(indptr) - 1]
+    starts, ends = indptr[nodes], indptr[nodes + 1]
+    counts = ends - starts
+    total = int(counts.sum())
+    if total == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    # positions = concat(range(start, end) for each node) without a Python loop
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    pos = offsets + np.arange(total, dtype=np.int64)
+    src = np.repeat(nodes, counts)
+    if allowed_types is not None:
+        keep = np.isin(arrays['types'][pos], allowed_types)
+        pos, src = pos[keep], src[keep]
+    return src, arrays['indices'][pos].astype(np.int64), pos
+
+
+def neighbours(layers, nodes, allowed_types=None):
+    """gather() over several CSR layers (base + delta): (sources, targets, types, weights)."""
+    out = [[], [], [], []]
+    for arrays in layers:
+        src, dst, pos = gather(arrays, nodes, allowed_types)
+        out[0].append(src)
+        out[1].append(dst)
+        out[2].append(arrays['types'][pos])
+        out[3].append(arrays['data'][pos])
+    return tuple(np.concatenate(parts) for parts in out)
+
+
+def reachable(layers, seeds, hops=1, allowed_types=None, size=None):
+    """Boolean mask of nodes reachable from `seeds` within `hops` edges (seeds excluded)."""
+    size = size or max(len(a['indptr']) - 1 for a in layers)
+    seen = np.zeros(size, dtype=bool)
+    frontier = np.unique(np.asarray(seeds, dtype=np.int64))
+    seen[frontier] = True
+    for _ in range(hops):
+        _, targets, _, _ = neighbours(layers, frontier, allowed_types)
+        targets = np.unique(targets)
+        frontier = targets[~seen[targets]]
+        if len(frontier) == 0: break
+        seen[frontier] = True
+    seen[np.asarray(seeds, dtype=np.int64)] = False
+    return seen
+
+
+def _undirected(out_layers, in_layers, frontier, allowed_types=None):
+    """Edges touching the frontier in either direction: (from, to, type, forward) with forward=False for in-edges."""
+    s1, d1, t1, _ = neighbours(out_layers, frontier, allowed_types)
+    s2, d2, t2, _ = neighbours(in_layers, frontier, allowed_types)
+    forward = np.concatenate([np.ones(len(s1), dtype=bool), np.zeros(len(s2), dtype=bool)])
+    return np.concatenate([s1, s2]), np.concatenate([d1, d2]), np.concatenate([t1, t2]), forward
+
+
+def shortest_path(out_layers, in_layers, source, target, max_hops=6, allowed_types=None, size=None):
+    """
+    Bidirectional BFS over the graph with edge direction ignored, always expanding the smaller frontier.
+    Returns the hops source -> target as [(u, v, type, forward)] (forward=False: the stored edge is v -> u),
+    [] when source == target and None when they are more than max_hops apart.
+    """
+    if source == target: return []
+    size = size or max(len(a['indptr']) - 1 for a in out_layers)
+    dist = [np.full(size, -1, dtype=np.int32), np.full(size, -1, dtype=np.int32)]
+    parent = [np.zeros(size, dtype=np.int64), np.zeros(size, dtype=np.int64)]
+    etype = [np.zeros(size, dtype=np.int32), np.zeros(size, dtype=np.int32)]
+    fwd = [np.zeros(size, dtype=bool), np.zeros(size, dtype=bool)]
+    dist[0][source], dist[1][target] = 0, 0
+    frontier = [np.array([source], dtype=np.int64), np.array([target], dtype=np.int64)]
+    depth = [0, 0]
+
+    meet = None
+    while depth[0] + depth[1] < max_hops and len(frontier[0]) and len(frontier[1]):
+        side = 0 if len(frontier[0]) <= len(frontier[1]) else 1
+        src, dst, types, forward = _undirected(out_layers, in_layers, frontier[side], allowed_types)
+        new = dist[side][dst] < 0
+        dst, first = np.unique(dst[new], return_index=True)
+        depth[side] += 1
+        dist[side][dst] = depth[side]
+        parent[side][dst] = src[new][first]
+        etype[side][dst] = types[new][first]
+        fwd[side][dst] = forward[new][first]
+        frontier[side] = dst
+        met = dst[dist[1 - side][dst] >= 0]
+        if len(met):
+            meet = int(met[np.argmin(dist[1 - side][met])])  # closest to the other end = shortest overall
+            break
+    if meet is None: return None
+
+    hops = []
+    x = meet
+    while x != source:  # source side, walked backwards
+        p = int(parent[0][x])
+        hops.append((p, x, int(etype[0][x]), bool(fwd[0][x])))
+        x = p
+    hops.reverse()
+    x = meet
+    while x != target:  # target side: edges were discovered from the target end, so direction flips
+        p = int(parent[1][x])
+        hops.append((x, p, int(etype[1][x]), not fwd[1][x]))
+        x = p
+    return hops
+
+
+# GraphDelta records in the `graph_delta` storage sub-db (big-endian, so keys sort by position / target):
+#   n<pos> -> concept id    e<pos> -> (u, v, weight, type)    p<target id>\0<u><type> -> weight
+_POS = struct.Struct('>Q')
+_EDGE = struct.Struct('>qqfi')
+_PENDING = struct.Struct('>qi')
+_WEIGHT = struct.Struct('>f')
+
+
+def _pending_key(target_id, u, type_code):
+    return b'p' + target_id.encode('utf-8') + b'\0' + _PENDING.pack(u, type_code)
+
+
+class GraphDelta:
+    """
+    Nodes and edges added since the CSR arrays were last written.
+    Kept as small COO lists, merged with the base CSR at query time and folded in by compaction,
+    so learning a concept costs O(its relations) instead of a full graph rebuild.
+    Persisted append-only in the shared Storage: save() writes only what changed since the last save.
+    """
+
+    def __init__(self, nodes=None, rows=None, cols=None, data=None, types=None, pending=None):
+        self.nodes = list(nodes or [])  # concept ids appended after the base node_map
+        self.rows = list(rows or [])
+        self.cols = list(cols or [])
+        self.data = list(data or [])
+        self.types = list(types or [])
+        # Dangling edges, keyed by the concept id they point at: {target_id: [[u, weight, type], ...]}
+        self.pending = dict(pending or {})
+        self._csr = None
+        self._saved = (0, 0)  # nodes / edges already in storage
+        self._changes = {}  # pending-edge keys changed since the last save (None = deleted)
+        self._wipe = set()  # record kinds to drop from storage before the next save
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add_edge(self, u, v, weight=1.0, type_code=0):
+        self.rows.append(u)
+        self.cols.append(v)
+        self.data.append(weight)
+        self.types.append(type_code)
+        self._csr = None
+
+    def arrays(self, size):
+        if self._csr is None or len(self._csr['indptr']) - 1 != size:
+            self._csr = build_csr(self.rows, self.cols, size, self.data, self.types)
+        return self._csr
+
+    def add_pending(self, target_id, u, weight=1.0, type_code=0):
+        waiting = self.pending.setdefault(target_id, [])
+        if any(e[0] == u and e[2] == type_code for e in waiting): return
+        waiting.append([u, weight, type_code])
+        self._changes[_pending_key(target_id, u, type_code)] = _WEIGHT.pack(weight)
+
+    def resolve_pending(self, target_id, v):
+        """Attaches every edge that was waiting for target_id (now node v). O(edges waiting)."""
+        waiting = self.pending.pop(target_id, [])
+        for u, weight, type_code in waiting:
+            self._changes[_pending_key(target_id, u, type_code)] = None
+            self.add_edge(u, v, weight, type_code)
+        return len(waiting)
+
+    def clear(self, keep_pending=True):
+        """Drops nodes/edges once they are in the CSR; dangling edges stay pending unless keep_pending=False."""
+        wipe = self._wipe | ({b'n', b'e'} if keep_pending else {b'n', b'e', b'p'})
+        changes = self._changes if keep_pending else {}
+        self.__init__(pending=self.pending if keep_pending else None)
+        self._changes, self._wipe = changes, wipe
+
+    @classmethod
+    def load(cls, storage=None, legacy_path=None):
+        """
+        Reads the `graph_delta` sub-db. A delta.json written by older versions takes precedence and is
+        loaded as unsaved, so the next save() migrates it.
+        """
+        if legacy_path and os.path.exists(legacy_path):
+            with open(legacy_path) as f: delta = cls(**json.load(f))
+            for target, waiting in delta.pending.items():
+                for u, weight, type_code in waiting:
+                    delta._changes[_pending_key(target, u, type_code)] = _WEIGHT.pack(weight)
+            delta._wipe = {b'n', b'e', b'p'}
+            return delta
+
+        delta = cls()
+        if storage is None or 'graph_delta' not in storage: return delta
+        for key, val in storage.read(lambda txn: list(txn.cursor()), 'graph_delta'):
+            kind = key[:1]
+            if kind == b'n':
+                delta.nodes.append(val.decode('utf-8'))
+            elif kind == b'e':
+                delta.add_edge(*_EDGE.unpack(val))
+            elif kind == b'p':
+                u, type_code = _PENDING.unpack(key[-_PENDING.size:])
+                target = key[1:-_PENDING.size - 1].decode('utf-8')
+                delta.pending.setdefault(target, []).append([u, _WEIGHT.unpack(val)[0], type_code])
+        delta._saved = (len(delta.nodes), len(delta.rows))
+        return delta
+
+    def save(self, storage):
+        """
+        Writes the changes since the last save: new nodes / edges are appended under their position,
+        pending edges are put or deleted one key each. O(change), never a rewrite of the whole delta.
+        """
+        n0, e0 = self._saved
+        puts = [(b'n' + _POS.pack(i), self.nodes[i].encode('utf-8')) for i in range(n0, len(self.nodes))]
+        puts += [(b'e' + _POS.pack(i), _EDGE.pack(self.rows[i], self.cols[i], self.data[i], self.types[i]))
+                 for i in range(e0, len(self.rows))]
+        changes, wipe = self._changes, self._wipe
+        if not (puts or changes or wipe): return
+
+        def write(txn):
+            cur = txn.cursor()
+            for kind in wipe:
+                if cur.set_range(kind):
+                    while cur.key()[:1] == kind and cur.delete(): pass
+            for key, val in changes.items():
+                if val is None: txn.delete(key)
+                else: txn.put(key, val)
+            for key, val in puts: txn.put(key, val)
+        storage.write(write, 'graph_delta')
+        self._saved, self._changes, self._wipe = (len(self.nodes), len(self.rows)), {}, set()
+
+
+def merge_csr(arrays, delta, size):
+    """Base CSR + delta edges -> one CSR over `size` nodes (pure NumPy, no concept reads)."""
+    base_rows = np.repeat(np.arange(len(arrays['indptr']) - 1, dtype=np.int64), np.diff(arrays['indptr']))
+    rows = np.concatenate([base_rows, np.asarray(delta.rows, dtype=np.int64)])
+    cols = np.concatenate([arrays['indices'], np.asarray(delta.cols, dtype=np.int32)])
+    data = np.concatenate([arrays['data'], np.asarray(delta.data, dtype=np.float32)])
+    types = np.concatenate([arrays['types'], np.asarray(delta.types, dtype=np.int32)])
+    return build_csr(rows, cols, size, data, types)
+
+
+def select_edges(arrays, type_codes):
+    """(rows, cols) of the edges with one of the given type codes (self-loops dropped)."""
+    indptr, indices = arrays['indptr'], arrays['indices']
+    rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+    keep = np.isin(arrays['types'], type_codes) & (rows != indices)
+    return rows[keep], indices[keep].astype(np.int64)
+
+
+def pagerank(arrays, damping=0.85, tol=1e-8, max_iter=100):
+    """PageRank by power iteration over the confidence-weighted CSR (dangling mass spread uniformly)."""
+    A = to_scipy(arrays).astype(np.float64)
+    n = A.shape[0]
+    if n == 0: return np.zeros(0, dtype=np.float32)
+    out = np.asarray(A.sum(axis=1)).ravel()
+    dangling = out <= 0
+    inv = np.divide(1.0, out, out=np.zeros(n), where=~dangling)
+    P = (sparse.diags(inv) @ A).T.tocsr()  # rank_next = P @ rank
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        nxt = damping * (P @ rank + rank[dangling].sum() / n) + (1 - damping) / n
+        done = np.abs(nxt - rank).sum() < tol
+        rank = nxt
+        if done: break
+    return rank.astype(np.float32)
+
+
+def hypernym_depth(rows, cols, size):
+    """Shortest is_a distance from each node up to a root (a node with no hypernym); -1 = only on cycles."""
+    children = build_csr(cols, rows, size)  # parent -> children
+    has_parent = np.zeros(size, dtype=bool)
+    has_parent[rows] = True
+    depth = np.full(size, -1, dtype=np.int32)
+    frontier, level = np.flatnonzero(~has_parent), 0
+    while len(frontier):
+        depth[frontier] = level
+        _, kids, _ = gather(children, frontier)
+        kids = np.unique(kids)
+        frontier = kids[depth[kids] < 0]
+        level += 1
+    return depth
+
+
+def ancestor_closure(rows, cols, size):
+    """
+    Transitive closure of the is_a edges as CSR (row x = every ancestor of x, sorted),
+    so a subsumption check is one binary search within a row instead of a walk.
+    """
+    A = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(size, size))
+    A.data[:] = 1
+    reach = A
+    while True:  # reach_k+1 = A + reach_k @ A, until no new ancestors appear (one step per hierarchy level)
+        nxt = (A + reach @ A).tocsr()
+        nxt.data[:] = 1
+        if nxt.nnz == reach.nnz: break
+        reach = nxt
+    reach.sort_indices()
+    return reach.indptr.astype(np.int64), reach.indices.astype(np.int32)
+
+
+def compute_analytics(arrays, rel_types):
+    """Offline graph statistics: PageRank, hypernym depth and the ancestor closure."""
+    size = len(arrays['indptr']) - 1
+    rows, cols = select_edges(arrays, rel_types.lookup(HYPERNYM_TYPES))
+    anc_indptr, anc_indices = ancestor_closure(rows, cols, size)
+    return {'pagerank': pagerank(arrays), 'depth': hypernym_depth(rows, cols, size),
+            'anc_indptr': anc_indptr, 'anc_indices': anc_indices}
+
+
+def structural_embedding(arrays, dim=64, oversample=10, power_iters=2, seed=0):
+    """
+    Spectral node embeddings: truncated randomized SVD (Halko et al.) of the undirected,
+    symmetrically normalized adjacency D^-1/2 (A + A^T) D^-1/2, rows scaled by sqrt(singular value).
+    Only sparse mat-mults and QR of an (n x dim) block, so it runs on CPU at WordNet/Wikidata scale.
+    Returns (vectors, has_edges); nodes without edges get zero vectors.
+    """
+    A = to_scipy(arrays).astype(np.float32)
+    A = (A + A.T).tocsr()
+    deg = np.asarray(A.sum(axis=1)).ravel()
+    inv = np.divide(1.0, np.sqrt(deg), out=np.zeros_like(deg), where=deg > 0)
+    M = (sparse.diags(inv) @ A @ sparse.diags(inv)).tocsr()
+
+    n = M.shape[0]
+    width = min(dim + oversample, n)
+    rng = np.random.default_rng(seed)
+    Q = np.linalg.qr(M @ rng.standard_normal((n, width)).astype(np.float32))[0]
+    for _ in range(power_iters):  # M is symmetric, so each power step is one more M @ Q
+        Q = np.linalg.qr(M @ Q)[0]
+    Ub, S, _ = np.linalg.svd((M @ Q).T, full_matrices=False)  # (Q^T M) is only width x n
+    dim = min(dim, width)
+    vecs = (Q @ Ub[:, :dim]) * np.sqrt(S[:dim])
+    return vecs.astype(np.float32), deg > 0
+
+
+def load_analytics(path):
+    if not os.path.exists(path): return None
+    loader = np.load(path)
+    return {k: loader[k] for k in loader.files}
+
+
+def ancestors_of(analytics, x):
+    indptr = analytics['anc_indptr']
+    return analytics['anc_indices'][indptr[x]:indptr[x + 1]]
+
+
+def has_ancestor(analytics, x, y):
+    """y in ancestors(x): binary search within x's closure row."""
+    row = ancestors_of(analytics, x)
+    i = np.searchsorted(row, y)
+    return bool(i < len(row) and row[i] == y)
@@ -1,9 +1,45 @@
 import faiss
 import duckdb
 import numpy as np
+import pyarrow as pa
 import os
 import json
-from scipy import sparse
+import re
+from src.bitmap import IdBitmap, save_bitmaps
+from src.labels import LabelIndex
+from src.storage import Storage
+from src.graph import GraphDelta, RelationTypes, build_csr, save_csr, compute_analytics, structural_embedding
+
+# Per-modality vector indexes: (embedding field, FAISS metric, L2-normalize before indexing)
+# Text keeps raw L2 distances (the agent's UNKNOWN_THRESHOLD is tuned on them);
+# CLIP vectors are normalized so inner product == cosine for cross-modal search.
+MODALITIES = {
+    'text': ('text_embedding', faiss.METRIC_L2, False),
+    'image': ('image_embedding', faiss.METRIC_INNER_PRODUCT, True),
+    # Structural (spectral) embeddings of the concept graph, computed by the indexer itself
+    'graph': ('graph_embedding', faiss.METRIC_INNER_PRODUCT, True),
+}
+
+GRAPH_EMBEDDING_DIM = 64
+
+
+# Predicates persisted as bitmaps at build time ("pos=n", "lex_domain=noun.animal", "source=wn", ...)
+BITMAP_KEYS = ('pos', 'lex_domain')
+_SOURCE_SEP = re.compile(r"[_:]")
+
+
+def id_source(cid):
+    # Concept ids are "<source>_<local id>": wn_..., wiki_Q..., web_... (build_crs.py writes "wn:...")
+    return _SOURCE_SEP.split(cid, 1)[0]
+
+
+PROPS_SCHEMA = pa.schema([('id', pa.string()), ('key', pa.string()), ('val_str', pa.string())])
+
+
+def id_map_path(root, modality):
+    # Text keeps its original file name so existing builds keep loading
+    if modality == 'text': return f"{root}/metadata/faiss_id_map.json"
+    return f"{root}/metadata/{modality}_id_map.json"
 
 
 class CRSIndexer:
@@ -19,13 +55,31 @@ class CRSIndexer:
         concepts_metadata: List of dicts {id, embedding, relations, properties}
         """
         print("Building FAISS Index...")
-        self._build_faiss(concepts_metadata)
+        for modality in MODALITIES:
+            self._build_faiss(concepts_metadata, modality)
+
+        print("Building Predicate Bitmaps...")
+        self._build_bitmaps(concepts_metadata)
 
         print("Building DuckDB Store...")
         self._build_duckdb(concepts_metadata)
 
         print("Building CSR Graph...")
-        self._build_csr(concepts_metadata)
+        arrays, rel_types, delta = self._build_csr(concepts_metadata)
+
+        print("Building Graph Analytics...")
+        self._build_analytics(arrays, rel_types)
+
+        print("Building Structural Embeddings...")
+        self._build_graph_embeddings(concepts_metadata, arrays)
+
+        print("Building Label Index...")
+        storage = Storage(f"{self.root}/storage")
+        storage.clear('id_maps')  # rows the agent appended to the previous vector indexes
+        storage.clear('graph_delta')  # fresh graph delta: only this build's pending edges
+        delta.save(storage)
+        self._build_labels(concepts_metadata, storage)
+        storage.close()
 
     # def _build_faiss(self, data):
     #     # Extract embeddings
@@ -52,60 +106,111 @@ class CRSIndexer:
     #     with open(f"{self.root}/metadata/faiss_id_map.json", 'w') as f:
     #         json.dump(mapping, f)
 
-    def _build_faiss(self, data):
+    def _build_faiss(self, data, modality='text'):
+        field = MODALITIES[modality][0]
+
         # 1. Filter only items that HAVE embeddings
-        valid_items = [item for item in data if item.get('text_embedding')]
+        valid_items = [item for item in data if item.get(field)]
 
         if not valid_items:
             return
 
         # 2. Prepare data for FAISS
-        vecs = [item['text_embedding'] for item in valid_items]
-        d = len(vecs[0])
-        vecs_np = np.array(vecs).astype('float32')
+        vecs_np = np.array([item[field] for item in valid_items]).astype('float32')
+        self._write_faiss(modality, vecs_np, [item['id'] for item in valid_items])
+
+    def _write_faiss(self, modality, vecs_np, ids):
+        _, metric, normalize = MODALITIES[modality]
+        if normalize: faiss.normalize_L2(vecs_np)
 
         # 3. Build Index
-        index = faiss.IndexHNSWFlat(d, 32)
+        index = faiss.IndexHNSWFlat(vecs_np.shape[1], 32, metric)
         index.add(vecs_np)
 
-        faiss.write_index(index, f"{self.root}/vectors/text.faiss")
+        faiss.write_index(index, f"{self.root}/vectors/{modality}.faiss")
 
         # 4. Save ID mapping (FAISS sequential ID -> Concept ID)
         # FAISS assigns IDs 0, 1, 2... automatically. We map 0 to the first valid item, 1 to the second, etc.
-        mapping = {i: item['id'] for i, item in enumerate(valid_items)}
+        mapping = {i: cid for i, cid in enumerate(ids)}
 
-        with open(f"{self.root}/metadata/faiss_id_map.json", 'w') as f:
+        with open(id_map_path(self.root, modality), 'w') as f:
             json.dump(mapping, f)
 
+    def _build_graph_embeddings(self, data, arrays):
+        # Randomized SVD of the normalized adjacency; isolated concepts have no structure to compare
+        vecs, has_edges = structural_embedding(arrays, GRAPH_EMBEDDING_DIM)
+        rows = np.flatnonzero(has_edges)
+        if len(rows) == 0: return
+        self._write_faiss('graph', np.ascontiguousarray(vecs[rows]), [data[i]['id'] for i in rows])
+
+    def _build_labels(self, data, storage):
+        # Primary labels first, then aliases: an alias never shadows another concept's label
+        def pairs():
+            for item in data:
+                yield item['label'], item['id']
+            for item in data:
+                for alias in item.get('aliases', []):
+                    yield alias, item['id']
+
+        count = LabelIndex(storage=storage).bulk_load(pairs())
+        print(f"   {count} distinct labels.")
+
+    def _build_bitmaps(self, data):
+        # Bit i == FAISS row i of the text index (same filter/order as _build_faiss)
+        valid_items = [item for item in data if item.get('text_embedding')]
+        size = len(valid_items)
+        rows = {}
+        for i, item in enumerate(valid_items):
+            rows.setdefault(f"source={id_source(item['id'])}", []).append(i)
+            for p in item.get('properties', []):
+                if p['key'] in BITMAP_KEYS:
+                    rows.setdefault(f"{p['key']}={p['value']}", []).append(i)
 
+        bitmaps = {name: IdBitmap.from_ids(ids, size) for name, ids in rows.items()}
+        save_bitmaps(f"{self.root}/properties/bitmaps.npz", bitmaps, size)
 
-    def _build_duckdb(self, data):
-        con = duckdb.connect(f"{self.root}/properties/properties.duckdb")
-        con.execute("CREATE TABLE IF NOT EXISTS props (id VARCHAR, key VARCHAR, val_str VARCHAR, val_num DOUBLE)")
-
-        # Batch insert
-        rows = []
+    def _prop_batches(self, data, batch_rows=200_000):
+        # Column buffers -> Arrow record batches (bounded memory, no per-row tuples)
+        ids, keys, vals = [], [], []
         for item in data:
             cid = item['id']
             for p in item.get('properties', []):
-                val = p['value']
-                # Try parsing float
-                try:
-                    val_num = float(val)
-                except:
-                    val_num = None
-                rows.append((cid, p['key'], str(val), val_num))
-
-        con.executemany("INSERT INTO props VALUES (?, ?, ?, ?)", rows)
+                ids.append(cid)
+                keys.append(p['key'])
+                vals.append(str(p['value']))
+            if len(ids) >= batch_rows:
+                yield pa.record_batch([pa.array(ids), pa.array(keys), pa.array(vals)], schema=PROPS_SCHEMA)
+                ids, keys, vals = [], [], []
+        if ids:
+            yield pa.record_batch([pa.array(ids), pa.array(keys), pa.array(vals)], schema=PROPS_SCHEMA)
+
+    def _build_duckdb(self, data):
+        con = duckdb.connect(f"{self.root}/properties/properties.duckdb")
+
+        # Bulk load: DuckDB scans the Arrow stream directly; val_num is parsed vectorised in SQL.
+        # Rows are physically clustered by (key, value) so per-row-group min/max zone maps prune
+        # both string lookups and numeric ranges. No secondary index: DuckDB only uses ART indexes for
+        # single-column point lookups, so a (key, val_str) index would just cost build time and space.
+        reader = pa.RecordBatchReader.from_batches(PROPS_SCHEMA, self._prop_batches(data))
+        con.register('props_stream', reader)
+        con.execute("""
+            CREATE OR REPLACE TABLE props AS
+            SELECT id, key, val_str, TRY_CAST(val_str AS DOUBLE) AS val_num FROM props_stream
+            ORDER BY key, val_num NULLS LAST, val_str, id
+        """)
+        con.unregister('props_stream')
         con.close()
 
     def _build_csr(self, data):
         # Create integer ID map
         id_to_int = {item['id']: i for i, item in enumerate(data)}
+        rel_types = RelationTypes.load(f"{self.root}/graph/rel_types.json")  # append-only: records hold these codes
+        delta = GraphDelta()  # fresh delta: keeps edges whose target isn't in this build as pending
 
         row_ind = []
         col_ind = []
         data_val = []
+        type_val = []
 
         for item in data:
             u = id_to_int[item['id']]
@@ -115,17 +220,24 @@ class CRSIndexer:
                     v = id_to_int[target]
                     row_ind.append(u)
                     col_ind.append(v)
-                    data_val.append(1)  # Unweighted for now, or use r['confidence']
+                    data_val.append(r.get('confidence', 1.0))  # Edge weight = relation confidence
+                    type_val.append(rel_types.code(r['type']))
+                else:
+                    delta.add_pending(target, u, r.get('confidence', 1.0), rel_types.code(r['type']))
 
-        # Build Matrix
+        # Build Matrix (types stay aligned with indices so queries can follow e.g. only is_a edges)
         size = len(data)
-        adj_matrix = sparse.csr_matrix((data_val, (row_ind, col_ind)), shape=(size, size))
+        arrays = build_csr(row_ind, col_ind, size, data_val, type_val)
 
         # Save buffers
-        np.savez(f"{self.root}/graph/csr_arrays.npz",
-                 indptr=adj_matrix.indptr,
-                 indices=adj_matrix.indices,
-                 data=adj_matrix.data)
+        save_csr(f"{self.root}/graph/csr_arrays.npz", arrays)
+        rel_types.save(f"{self.root}/graph/rel_types.json")
+        if os.path.exists(f"{self.root}/graph/delta.json"): os.remove(f"{self.root}/graph/delta.json")
 
         with open(f"{self.root}/graph/node_map.json", 'w') as f:
-            json.dump(id_to_int, f)
\ No newline at end of file
+            json.dump(id_to_int, f)
+        return arrays, rel_types, delta
+
+    def _build_analytics(self, arrays, rel_types):
+        # PageRank, is_a depth and ancestor closure, so "how general is X" / "is X a Y" are lookups at query time
+        np.savez(f"{self.root}/graph/analytics.npz", **compute_analytics(arrays, rel_types))
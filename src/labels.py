@@ -0,0 +1,172 @@
+import json
+import re
+import unicodedata
+from src.storage import Storage
+
+FUZZY_MIN_LEN = 4  # shorter labels are too ambiguous to correct
+_PUNCT = re.compile(r"[^\w\s]")
+_SPACE = re.compile(r"[\s_]+")
+
+
+def normalize_label(text):
+    """'  Sam_Altman? ' -> 'sam altman', 'Café-au-lait' -> 'cafe au lait'."""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    text = _PUNCT.sub(' ', text.replace("'", ''))
+    return _SPACE.sub(' ', text).strip()
+
+
+def _deletes(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def edit_distance(a, b, limit=2):
+    """Optimal-string-alignment (Damerau) distance, stopping early once every path exceeds `limit`."""
+    if abs(len(a) - len(b)) > limit: return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit: return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _singular_forms(word):
+    # Cheap plural folding for the last word: "boxes" -> "box", "berries" -> "berry", "dogs" -> "dog"
+    forms = []
+    if word.endswith('ies') and len(word) > 4: forms.append(word[:-3] + 'y')
+    if word.endswith('es') and len(word) > 3: forms.append(word[:-2])
+    if word.endswith('s') and not word.endswith('ss') and len(word) > 3: forms.append(word[:-1])
+    return forms
+
+
+class LabelIndex:
+    """
+    Persistent label/alias -> concept id index (LMDB, keys = normalized labels, sorted on disk).
+    Supports exact (normalized) lookups and prefix scans without loading anything into memory.
+    Typo tolerance is SymSpell-style: every label's single-character deletes are stored in a
+    dupsort sub-database, so a fuzzy lookup is ~len(query) point reads plus a few distance checks.
+    Lives in the shared CRS Storage (`labels` / `label_deletes`), or its own environment at `path`.
+    """
+
+    def __init__(self, path=None, readonly=False, storage=None):
+        self.owns_storage = storage is None
+        self.storage = storage or Storage(path, readonly, databases=('labels', 'label_deletes'))
+        self.env = self.storage.env
+        self.db = self.storage.db('labels')
+        self.deletes = self.storage.db('label_deletes')
+
+    def get(self, text):
+        key = normalize_label(text)
+        if not key: return None
+        val = self.storage.get('labels', key.encode('utf-8'))
+        return val.decode('utf-8') if val else None
+
+    def __contains__(self, text):
+        return self.get(text) is not None
+
+    def __len__(self):
+        return self.storage.read(lambda txn: txn.stat(self.db)['entries'])
+
+    def prefix(self, text, limit=10):
+        """[(label, concept_id)] for labels starting with text, in sorted order."""
+        key = normalize_label(text).encode('utf-8')
+
+        def scan(txn):
+            out = []
+            cur = txn.cursor()
+            if not cur.set_range(key): return out
+            for k, v in cur:
+                if not k.startswith(key) or len(out) >= limit: break
+                out.append((k.decode('utf-8'), v.decode('utf-8')))
+            return out
+        return self.storage.read(scan, 'labels')
+
+    def fuzzy(self, text, max_distance=None):
+        """
+        Best (concept_id, label, distance) for a misspelled / plural label, else None.
+        Default tolerance: 1 edit for short labels, 2 for labels of 8+ characters.
+        Plural folds come back with distance 0; a typo match is only a spelling candidate
+        (a new name can be one edit from an unrelated label), so callers should confirm it.
+        """
+        key = normalize_label(text)
+        if len(key) < FUZZY_MIN_LEN: return None
+        if max_distance is None: max_distance = 1 if len(key) < 8 else 2
+
+        def lookup(txn):
+            # 1. Plural folding is an exact hit, not a typo
+            for form in _singular_forms(key):
+                val = txn.get(form.encode('utf-8'), db=self.db)
+                if val: return val.decode('utf-8'), form, 0
+
+            # 2. Symmetric deletes: query and its 1-deletes vs labels and their 1-deletes
+            candidates = set()
+            cur = txn.cursor(db=self.deletes)
+            for probe in {key} | _deletes(key):
+                p = probe.encode('utf-8')
+                if probe != key and txn.get(p, db=self.db): candidates.add(probe)
+                if cur.set_key(p):
+                    candidates.update(v.decode('utf-8') for v in cur.iternext_dup())
+
+            best = None
+            for cand in candidates:
+                d = edit_distance(key, cand, max_distance)
+                if d <= max_distance and (best is None or (d, cand) < best[:2]):
+                    best = (d, cand)
+            if best is None: return None
+            cid = txn.get(best[1].encode('utf-8'), db=self.db)
+            return cid.decode('utf-8'), best[1], best[0]
+        return self.storage.read(lookup)
+
+    def add(self, label, cid, overwrite=True):
+        self.add_many([(label, cid)], overwrite)
+
+    def add_many(self, pairs, overwrite=True):
+        pairs = list(pairs)
+
+        def put(txn):
+            for label, cid in pairs:
+                key = normalize_label(label)
+                if not key: continue
+                kb = key.encode('utf-8')
+                txn.put(kb, cid.encode('utf-8'), overwrite=overwrite)
+                if len(key) >= FUZZY_MIN_LEN:
+                    for d in _deletes(key):
+                        txn.put(d.encode('utf-8'), kb, db=self.deletes, dupdata=True)
+        self.storage.write(put, 'labels')
+
+    def bulk_load(self, pairs):
+        """
+        Replaces the index with `pairs` (first occurrence of a label wins).
+        Keys are written in sorted order with append=True: sequential B-tree fill, no page splits.
+        """
+        table = {}
+        for label, cid in pairs:
+            key = normalize_label(label)
+            if key: table.setdefault(key.encode('utf-8'), cid.encode('utf-8'))
+        def fill(txn):
+            txn.drop(self.db, delete=False)
+            txn.cursor().putmulti(((k, table[k]) for k in sorted(table)), append=True)
+        self.storage.write(fill, 'labels')
+
+        # Delete index: sorted (delete, label) pairs, written in bounded chunks
+        keys = [k.decode('utf-8') for k in table if len(k) >= FUZZY_MIN_LEN]
+        pairs = sorted((d.encode('utf-8'), k.encode('utf-8')) for k in keys for d in _deletes(k))
+        self.storage.clear('label_deletes')
+        for i in range(0, len(pairs), 500_000):
+            chunk = pairs[i:i + 500_000]
+            self.storage.write(lambda txn: txn.cursor().putmulti(chunk, dupdata=True, append=True), 'label_deletes')
+        return len(table)
+
+    def import_json(self, path):
+        """One-off migration of the old metadata/label_index.json dict."""
+        with open(path) as f:
+            self.add_many(json.load(f).items(), overwrite=False)
+
+    def close(self):
+        if self.owns_storage: self.storage.close()
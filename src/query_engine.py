@@ -5,52 +5,281 @@ import json
 import flatbuffers
 import sys
 import os
-import lmdb  # New dependency
-from scipy import sparse
+import time
+import pyarrow as pa
+from src import graph as G
+from src.labels import LabelIndex
+from src.bitmap import IdBitmap, load_bitmaps
+from src.storage import Storage, embedding_key, decode_embedding, sidecar_path
+from src.indexer import MODALITIES, PROPS_SCHEMA, BITMAP_KEYS, id_map_path, id_source
 
 sys.path.append('./generated')
 import crs.Concept as C
 
+# Graph-aware re-ranking: candidates fetched per requested result, and the score mix
+RERANK_POOL = 4
+RERANK_WEIGHTS = {'distance': 1.0, 'pagerank': 0.1, 'ancestors': 0.3, 'confidence': 0.2}
+RRF_K = 60  # reciprocal rank fusion damping (score = sum 1 / (RRF_K + rank))
+
+
+def _minmax(x):
+    span = x.max() - x.min()
+    return (x - x.min()) / span if span > 0 else np.zeros(len(x))
+
 
 class CRS:
-    def __init__(self, root="data"):
+    def __init__(self, root="data", readonly=True):
         self.root = root
+        self.readonly = readonly  # the agent opens CRS writable to record what it learns
 
-        # 1. Open LMDB (The Packed DB)
-        # map_size=0 means use existing size. readonly=True for speed.
-        self.env = None
+        # 1. Open LMDB (The Packed DB): one shared environment with named sub-dbs (src/storage.py)
+        self.storage = None
         db_path = f"{root}/storage"
-        if os.path.exists(f"{db_path}/data.mdb"):
+        if not readonly or os.path.exists(f"{db_path}/data.mdb"):
             try:
-                self.env = lmdb.open(db_path, readonly=True, lock=False)
+                self.storage = Storage(db_path, readonly=readonly)
             except Exception as e:
                 print(f"⚠️ Warning: Could not open LMDB: {e}")
 
         # 2. Load FAISS (Vectors)
         self.index = faiss.read_index(f"{root}/vectors/text.faiss")
-        with open(f"{root}/metadata/faiss_id_map.json") as f:
+        with open(id_map_path(root, 'text')) as f:
             self.faiss_map = {int(k): v for k, v in json.load(f).items()}
+        if self.storage: self.faiss_map.update(self.storage.id_map('text'))  # rows the agent appended
+
+        # 2b. Other modalities (optional, read-only -> memory-mapped where FAISS supports it)
+        self.vector_indexes = {'text': (self.index, self.faiss_map)}
+        for modality in MODALITIES:
+            path = f"{root}/vectors/{modality}.faiss"
+            if modality == 'text' or not os.path.exists(path): continue
+            index = self._read_index_mmap(path)
+            with open(id_map_path(root, modality)) as f:
+                id_map = {int(k): v for k, v in json.load(f).items()}
+            self.vector_indexes[modality] = (index, id_map)
 
         # 3. Load DuckDB (Properties)
-        self.db = duckdb.connect(f"{root}/properties/properties.duckdb", read_only=True)
+        # Offline-built store stays read-only; learned concepts go to a small delta DB.
+        # Queries see both through the `props` view.
+        self.db = duckdb.connect()
+        self.db.execute(f"ATTACH '{root}/properties/properties.duckdb' AS base (READ_ONLY)")
+        self.delta_path = f"{root}/properties/delta.duckdb"
+        self.has_delta = False
+        if not self._attach_delta() and os.path.exists(self.delta_path):
+            print("   ⚠️ Property delta is being written by another process; serving the base store only.")
+        self.pending_props = {}  # cid -> properties, appended to the delta on flush_properties()
 
         # 4. Load Graph (Relations)
-        loader = np.load(f"{root}/graph/csr_arrays.npz")
-        self.graph = sparse.csr_matrix((loader['data'], loader['indices'], loader['indptr']))
+        self.rel_types = G.RelationTypes.load(f"{root}/graph/rel_types.json")
         with open(f"{root}/graph/node_map.json") as f:
-            self.node_map = json.load(f)
-            self.rev_node_map = {v: k for k, v in self.node_map.items()}
+            node_map = json.load(f)
+        # Concepts/edges learned since the last compaction live in a small delta merged at query time
+        self.graph_delta = G.GraphDelta.load(self.storage, f"{root}/graph/delta.json")
+        if self.graph_delta.nodes and self.graph_delta.nodes[0] in node_map:
+            self.graph_delta.clear()  # compaction wrote the CSR but stopped before dropping the delta
+        for cid in self.graph_delta.nodes: node_map[cid] = len(node_map)
+        self._rel_types_saved = len(self.rel_types.names)
+        self.set_graph(G.load_csr(f"{root}/graph/csr_arrays.npz"), node_map)
+        # Offline PageRank / is_a depth / ancestor closure (None for builds that predate it)
+        self.analytics = G.load_analytics(f"{root}/graph/analytics.npz")
+
+        # 5. Label / alias index (symbolic lookups, no embedding needed)
+        # (shared storage; builds from before it kept a separate environment at <root>/labels)
+        self.labels = None
+        legacy = f"{root}/labels"
+        if self.storage and 'labels' in self.storage:
+            self.labels = LabelIndex(storage=self.storage)
+        if os.path.exists(f"{legacy}/data.mdb") and (self.labels is None or len(self.labels) == 0):
+            self.labels = LabelIndex(legacy, readonly=readonly)
+
+        # 6. Predicate bitmaps (bit i == FAISS row i) for common filters
+        bm_path = f"{root}/properties/bitmaps.npz"
+        self.bitmaps = load_bitmaps(bm_path) if os.path.exists(bm_path) else {}
+        self.bitmap_size = next(iter(self.bitmaps.values())).size if self.bitmaps else 0  # rows at build time
+
+    def set_graph(self, arrays, node_map):
+        self.graph_arrays = arrays
+        self.graph = G.to_scipy(arrays)  # base CSR only; graph_layers() includes the delta
+        self.node_map = node_map
+        self.rev_node_map = {v: k for k, v in node_map.items()}
+        self._graph_in = None
+
+    def graph_layers(self):
+        """Outgoing-edge CSR layers: the compacted base plus the delta (if any)."""
+        layers = [self.graph_arrays]
+        if len(self.graph_delta): layers.append(self.graph_delta.arrays(len(self.node_map)))
+        return layers
+
+    def graph_in(self):
+        """Incoming-edge CSR layers (base reversed once, on first use)."""
+        if self._graph_in is None:
+            self._graph_in = G.reverse_csr(self.graph_arrays)
+        layers = [self._graph_in]
+        if len(self.graph_delta): layers.append(G.reverse_csr(self.graph_delta.arrays(len(self.node_map))))
+        return layers
+
+    def add_graph_node(self, cid, relations):
+        """
+        Incremental graph update for a learned concept: O(len(relations) + edges waiting on cid).
+        Edges to concepts we don't know yet are parked as pending and attach when that concept arrives.
+        Returns the number of new edges.
+        """
+        added = 0
+        if cid not in self.node_map:
+            u = len(self.node_map)
+            self.node_map[cid] = u
+            self.rev_node_map[u] = cid
+            self.graph_delta.nodes.append(cid)
+            added += self.graph_delta.resolve_pending(cid, u)
+        u = self.node_map[cid]
+        _, dst, types, _ = G.neighbours(self.graph_layers(), [u])
+        existing = set(zip(dst.tolist(), types.tolist()))
+
+        for r in relations:
+            v = self.node_map.get(r['target_id'])
+            t = self.rel_types.code(r['type'])
+            if v is None:
+                self.graph_delta.add_pending(r['target_id'], u, r.get('confidence', 1.0), t)
+                continue
+            if (v, t) in existing: continue
+            existing.add((v, t))
+            self.graph_delta.add_edge(u, v, r.get('confidence', 1.0), t)
+            added += 1
+        return added
+
+    def save_graph_delta(self):
+        """Appends what the delta gained since the last save to storage (cheap enough to call per learn)."""
+        self.graph_delta.save(self.storage)
+        legacy = f"{self.root}/graph/delta.json"
+        if os.path.exists(legacy): os.replace(legacy, legacy + ".migrated")
+        if len(self.rel_types.names) != self._rel_types_saved:
+            self.rel_types.save(f"{self.root}/graph/rel_types.json")
+            self._rel_types_saved = len(self.rel_types.names)
+
+    def compact_graph(self):
+        """Folds the delta into the CSR arrays (NumPy merge, no concept re-reads) and rewrites the files."""
+        arrays = G.merge_csr(self.graph_arrays, self.graph_delta, len(self.node_map))
+        G.save_csr(f"{self.root}/graph/csr_arrays.npz", arrays)
+        with open(f"{self.root}/graph/node_map.json", 'w') as f:
+            json.dump(self.node_map, f)
+        self.graph_delta.clear()
+        self.save_graph_delta()
+        self.set_graph(arrays, self.node_map)
+        self.refresh_analytics()
+
+    def refresh_analytics(self):
+        """Recomputes graph/analytics.npz from the compacted CSR."""
+        self.analytics = G.compute_analytics(self.graph_arrays, self.rel_types)
+        np.savez(f"{self.root}/graph/analytics.npz", **self.analytics)
+
+    def _hypernym_codes(self):
+        return np.array(self.rel_types.lookup(G.HYPERNYM_TYPES), dtype=np.int32)
+
+    def _analytics_exact(self, x):
+        """
+        True if the precomputed closure/depth is current for node x: no is_a edge in the delta starts at x
+        or at one of its precomputed ancestors (edges below x, e.g. learned leaf concepts, leave it intact).
+        """
+        if self.analytics is None or x >= len(self.analytics['depth']): return False
+        delta = self.graph_delta
+        if getattr(self, '_delta_checked', None) != (id(delta.rows), len(delta)):
+            rows = np.asarray(delta.rows, dtype=np.int64)
+            self._delta_isa_sources = np.unique(rows[np.isin(delta.types, self._hypernym_codes())])
+            self._delta_checked = (id(delta.rows), len(delta))
+        if not len(self._delta_isa_sources): return True
+        return not np.isin(np.append(G.ancestors_of(self.analytics, x), x), self._delta_isa_sources).any()
+
+    def _ancestor_nodes(self, x):
+        if self._analytics_exact(x): return G.ancestors_of(self.analytics, x)
+        n = len(self.node_map)
+        return np.flatnonzero(G.reachable(self.graph_layers(), [x], n, self._hypernym_codes(), n))
+
+    def ancestors(self, cid):
+        """Every concept id that cid is (transitively) a kind or instance of."""
+        if cid not in self.node_map: return []
+        return [self.rev_node_map[int(i)] for i in self._ancestor_nodes(self.node_map[cid])]
+
+    def is_a(self, cid, ancestor):
+        """Subsumption check: a binary search in the precomputed closure (walks only for fresh is_a edges)."""
+        if cid == ancestor: return True
+        x, y = self.node_map.get(cid), self.node_map.get(ancestor)
+        if x is None or y is None: return False
+        if self._analytics_exact(x): return G.has_ancestor(self.analytics, x, y)
+        return bool(np.isin(y, self._ancestor_nodes(x)))
+
+    def depth(self, cid):
+        """is_a depth: 0 for a hierarchy root, larger = more specific; -1 if unknown."""
+        x = self.node_map.get(cid)
+        if x is None: return -1
+        if self._analytics_exact(x): return int(self.analytics['depth'][x])
+        # Walk up until a frontier node has no hypernym (same definition as the offline depth)
+        layers, codes = self.graph_layers(), self._hypernym_codes()
+        seen = np.zeros(len(self.node_map), dtype=bool)
+        frontier, level = np.array([x], dtype=np.int64), 0
+        seen[x] = True
+        while len(frontier):
+            src, parents, _, _ = G.neighbours(layers, frontier, codes)
+            if len(np.setdiff1d(frontier, src)): return level
+            parents = np.unique(parents)
+            frontier = parents[~seen[parents]]
+            seen[frontier] = True
+            level += 1
+        return -1
+
+    def path(self, a, b, max_hops=6, rel_types=None):
+        """
+        Shortest chain of relations linking two concepts (edge direction ignored while searching).
+        Returns [(subject, relation, object)] facts in path order, each as stored (e.g. (dog, is_a, canine)),
+        [] for a == b, None if no path within max_hops.
+        """
+        if a not in self.node_map or b not in self.node_map: return None
+        allowed = None if rel_types is None else np.array(self.rel_types.lookup(rel_types), dtype=np.int32)
+        hops = G.shortest_path(self.graph_layers(), self.graph_in(), self.node_map[a], self.node_map[b],
+                               max_hops, allowed, len(self.node_map))
+        if hops is None: return None
+        names, rev = self.rel_types.names, self.rev_node_map
+        return [(rev[u], names[t], rev[v]) if forward else (rev[v], names[t], rev[u]) for u, v, t, forward in hops]
+
+    def relatedness(self, a, b, max_hops=6):
+        """
+        Similarity in [0, 1]. Wu-Palmer over the is_a hierarchy when the concepts share an ancestor:
+        2 * depth(lcs) / (depth(a) + depth(b)), depths counted from 1 at the root.
+        Otherwise 1 / (1 + shortest path length) over any relation, 0.0 if unconnected.
+        """
+        if a == b: return 1.0
+        x, y = self.node_map.get(a), self.node_map.get(b)
+        if x is None or y is None: return 0.0
+        common = np.intersect1d(np.append(self._ancestor_nodes(x), x), np.append(self._ancestor_nodes(y), y))
+        if len(common):
+            d_lcs = max(self._node_depth(int(n)) for n in common) + 1
+            d_a, d_b = self._node_depth(x) + 1, self._node_depth(y) + 1
+            if d_lcs > 0 and d_a > 0 and d_b > 0: return min(1.0, 2.0 * d_lcs / (d_a + d_b))
+        hops = self.path(a, b, max_hops)
+        return 0.0 if hops is None else 1.0 / (1 + len(hops))
+
+    def _node_depth(self, x):
+        if self._analytics_exact(x): return int(self.analytics['depth'][x])
+        return self.depth(self.rev_node_map[x])
+
+    def pagerank(self, cid):
+        """Precomputed PageRank of cid (0.0 for concepts learned since the last compaction)."""
+        x = self.node_map.get(cid)
+        if x is None or self.analytics is None or x >= len(self.analytics['pagerank']): return 0.0
+        return float(self.analytics['pagerank'][x])
+
+    def faiss_ids(self):
+        """Concept id -> FAISS row, rebuilt when the agent has appended vectors."""
+        if getattr(self, '_faiss_rev_len', -1) != len(self.faiss_map):
+            self._faiss_rev = {cid: i for i, cid in self.faiss_map.items()}
+            self._faiss_rev_len = len(self.faiss_map)
+        return self._faiss_rev
 
     def get_concept(self, cid):
         """Reads Flatbuffer from LMDB (Fast) or Disk (Fallback)"""
-        # Strategy A: Check LMDB
-        if self.env:
-            with self.env.begin() as txn:
-                # LMDB keys are bytes, so encode the string ID
-                buf = txn.get(cid.encode('ascii'))
-                if buf:
-                    # Zero-copy read directly from memory
-                    return C.Concept.GetRootAsConcept(buf, 0)
+        # Strategy A: Check LMDB (`concepts` sub-db, or the unnamed DB of older packs)
+        if self.storage:
+            buf = self.storage.get_concept(cid)
+            if buf:
+                return C.Concept.GetRootAsConcept(buf, 0)
 
         # Strategy B: Check Loose File (Fallback for new/unpacked items)
         path = f"{self.root}/concepts/{cid}.bin"
@@ -61,23 +290,351 @@ class CRS:
 
         return None
 
-    def search_vector(self, embedding, k=5):
-        vec = np.array([embedding]).astype('float32')
-        D, I = self.index.search(vec, k)
-        results = []
-        for idx in I[0]:
-            if idx != -1:
-                cid = self.faiss_map[idx]
-                results.append(cid)
-        return results
+    def get_embedding(self, cid, modality='text'):
+        """
+        float32 vector for a concept: the LMDB `embeddings` sub-db (float16 on disk), then a loose
+        sidecar, then the vector index itself (normalized for cosine modalities). None if unknown.
+        """
+        if self.storage and 'embeddings' in self.storage:
+            buf = self.storage.get('embeddings', embedding_key(cid, modality))
+            if buf: return decode_embedding(buf)
+        path = sidecar_path(f"{self.root}/concepts", cid, modality)
+        if os.path.exists(path):
+            with open(path, 'rb') as f: return decode_embedding(f.read())
+        if modality in self.vector_indexes:
+            row = self._modality_rows(modality).get(cid)
+            if row is not None: return self.vector_indexes[modality][0].reconstruct(int(row))
+        return None
 
-    def filter_properties(self, key, val):
-        res = self.db.execute("SELECT id FROM props WHERE key=? AND val_str=?", [key, val]).fetchall()
+    @staticmethod
+    def _read_index_mmap(path):
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Older FAISS builds can't mmap every index type
+            return faiss.read_index(path)
+
+    def lookup_label(self, text):
+        """Concept id for an exact (normalized) label or alias, else None."""
+        return self.labels.get(text) if self.labels else None
+
+    def search_vectors(self, embeddings, k=5, modality='text'):
+        """Batched search: one FAISS call for many queries. Returns one id list per query."""
+        return [[cid for cid, _ in hits] for hits in self.search_hits(embeddings, k, modality)]
+
+    def search_hits(self, embeddings, k=5, modality='text'):
+        """Like search_vectors, but [(concept_id, distance)] per query (IP score for normalized modalities)."""
+        if modality not in self.vector_indexes: return [[] for _ in embeddings]
+        index, id_map = self.vector_indexes[modality]
+        vecs = np.array(embeddings).astype('float32')
+        if MODALITIES[modality][2]: faiss.normalize_L2(vecs)
+        D, I = index.search(vecs, k)
+        return [[(id_map[idx], float(d)) for d, idx in zip(drow, irow) if idx != -1] for drow, irow in zip(D, I)]
+
+    def search_vector(self, embedding, k=5, modality='text', rerank=False, context=None):
+        """
+        Top-k concept ids. rerank=True over-fetches RERANK_POOL * k candidates and reorders them
+        with graph signals (see rerank); `context` = concept ids the query is about (e.g. recent answers).
+        """
+        if not rerank: return self.search_vectors([embedding], k, modality)[0]
+        hits = self.search_hits([embedding], max(k * RERANK_POOL, 20), modality)[0]
+        return [cid for cid, _ in self.rerank(hits, context, modality)[:k]]
+
+    def _modality_rows(self, modality):
+        """Concept id -> row in that modality's index (cached per index size)."""
+        if modality == 'text': return self.faiss_ids()
+        cache = self.__dict__.setdefault('_modality_rev', {})
+        index, id_map = self.vector_indexes[modality]
+        if modality not in cache or len(cache[modality]) != len(id_map):
+            cache[modality] = {cid: i for i, cid in id_map.items()}
+        return cache[modality]
+
+    def similar_structure(self, cid, k=10):
+        """Concepts whose graph neighbourhood looks like cid's (spectral 'graph' index), best first."""
+        return [c for c, _ in self.similar_concepts(cid, k, modalities=('graph',))]
+
+    def similar_concepts(self, cid, k=10, modalities=('text', 'graph')):
+        """
+        Concepts similar to cid in every modality it has a vector for, fused with reciprocal rank fusion
+        (ranks, not raw scores, so L2 text distances and cosine graph scores combine safely).
+        Returns [(concept_id, fused score)] best first, cid itself excluded.
+        """
+        fused = {}
+        for modality in modalities:
+            if modality not in self.vector_indexes: continue
+            row = self._modality_rows(modality).get(cid)
+            if row is None: continue
+            index, _ = self.vector_indexes[modality]
+            hits = self.search_hits([index.reconstruct(int(row))], k + 1, modality)[0]
+            for rank, (other, _) in enumerate(c for c in hits if c[0] != cid):
+                fused[other] = fused.get(other, 0.0) + 1.0 / (RRF_K + rank + 1)
+        return sorted(fused.items(), key=lambda x: -x[1])[:k]
+
+    def rerank(self, hits, context=None, modality='text', weights=None):
+        """
+        Re-scores [(concept_id, distance)] with graph signals, vectorised over the candidates:
+          distance   - vector similarity, min-max scaled over the candidates
+          pagerank   - log PageRank, min-max scaled (prefers central, well-connected concepts)
+          ancestors  - share of the candidate's is_a ancestors that are context concepts or their ancestors
+          confidence - strongest edge between the candidate and a context concept
+        Returns [(concept_id, score)] best first.
+        """
+        if not hits: return []
+        w = dict(RERANK_WEIGHTS, **(weights or {}))
+        cids = [cid for cid, _ in hits]
+        dist = np.array([d for _, d in hits], dtype=np.float64)
+        sim = dist if MODALITIES[modality][1] == faiss.METRIC_INNER_PRODUCT else -dist
+        score = w['distance'] * _minmax(sim)
+
+        nodes = np.array([self.node_map.get(c, -1) for c in cids], dtype=np.int64)
+        known = nodes >= 0
+        a = self.analytics
+        if a is not None:
+            pr = np.zeros(len(nodes))
+            old = known & (nodes < len(a['pagerank']))
+            pr[old] = np.log(a['pagerank'][nodes[old]] * len(a['pagerank']))
+            pr[~old] = pr[old].min() if old.any() else 0.0
+            score += w['pagerank'] * _minmax(pr)
+
+        ctx = [self.node_map[c] for c in (context or []) if c in self.node_map]
+        if ctx and known.any():
+            pos = np.flatnonzero(known)
+            slot_of = np.full(len(self.node_map), -1, dtype=np.int64)  # graph node -> position in `pos`
+            slot_of[nodes[pos]] = np.arange(len(pos))
+            is_ctx = np.zeros(len(self.node_map), dtype=bool)
+            is_ctx[ctx] = True
+
+            if a is not None:
+                closure = {'indptr': a['anc_indptr'], 'indices': a['anc_indices']}
+                _, ctx_anc, _ = G.gather(closure, ctx)
+                ctx_mask = is_ctx.copy()  # context concepts plus everything they are a kind of
+                ctx_mask[ctx_anc] = True
+                src, anc, _ = G.gather(closure, nodes[pos])
+                shared = np.bincount(slot_of[src], weights=ctx_mask[anc], minlength=len(pos))
+                total = np.bincount(slot_of[src], minlength=len(pos))
+                score[pos] += w['ancestors'] * np.divide(shared, total, out=np.zeros(len(pos)), where=total > 0)
+
+            conf = np.zeros(len(pos))
+            for layers in (self.graph_layers(), self.graph_in()):
+                src, dst, _, weight = G.neighbours(layers, nodes[pos])
+                hit = is_ctx[dst]
+                np.maximum.at(conf, slot_of[src[hit]], weight[hit])
+            score[pos] += w['confidence'] * conf
+
+        order = np.argsort(-score, kind='stable')
+        return [(cids[i], float(score[i])) for i in order]
+
+    def search_images_by_text(self, clip_text_embeddings, k=5):
+        """Cross-modal search: CLIP text embeddings (see embed_clip_text_batch) -> image concepts."""
+        return self.search_vectors(clip_text_embeddings, k, modality='image')
+
+    @staticmethod
+    def _predicate_sql(key, op, value=None):
+        """One (key, op, value) predicate -> (SQL, params). Numeric ops use val_num, string ops val_str."""
+        if op == '=':
+            if isinstance(value, (int, float)): return "key = ? AND val_num = ?", [key, value]
+            return "key = ? AND val_str = ?", [key, str(value)]
+        if op == '!=':
+            return "key = ? AND val_str != ?", [key, str(value)]
+        if op in ('<', '<=', '>', '>='):
+            return f"key = ? AND val_num {op} ?", [key, float(value)]
+        if op == 'between':
+            return "key = ? AND val_num BETWEEN ? AND ?", [key, float(value[0]), float(value[1])]
+        if op == 'in':
+            values = [str(v) for v in value]
+            return f"key = ? AND val_str IN ({','.join('?' * len(values))})", [key] + values
+        if op == 'prefix':
+            return "key = ? AND starts_with(val_str, ?)", [key, str(value)]
+        if op == 'exists':
+            return "key = ?", [key]
+        raise ValueError(f"Unknown property operator: {op}")
+
+    def query_properties(self, *predicates, mode='and'):
+        """
+        Multi-predicate property filter in one SQL round trip.
+        predicates: (key, op, value) with op in = != < <= > >= between in prefix exists
+        e.g. query_properties(('pos', '=', 'n'), ('height', '>', 2))
+        mode: 'and' -> ids matching every predicate, 'or' -> ids matching any.
+        """
+        if not predicates: return []
+        parts, params = [], []
+        for pred in predicates:
+            sql, p = self._predicate_sql(*pred)
+            parts.append(f"SELECT id FROM props WHERE {sql}")
+            params.extend(p)
+        set_op = " INTERSECT " if mode == 'and' else " UNION "
+        res = self.db.execute(set_op.join(parts), params).fetchall()
         return [r[0] for r in res]
 
+    def ids_to_bitmap(self, cids):
+        rev = self.faiss_ids()
+        return IdBitmap.from_ids([rev[c] for c in cids if c in rev], self.index.ntotal)
+
+    def bitmap_to_ids(self, bitmap):
+        return [self.faiss_map[i] for i in bitmap.to_ids() if i in self.faiss_map]
+
+    def predicate_bitmap(self, key, op='=', value=None):
+        """Bitmap of concepts matching one predicate; persisted bitmaps answer pos/lex_domain/source equality."""
+        n = self.index.ntotal
+        name = f"{key}={value}"
+        persisted = self.bitmaps and (key in BITMAP_KEYS or key == 'source')
+        if op == '=' and (persisted or key == 'source'):
+            # Every value present at build time has a bitmap, so a missing one matched no built rows
+            bm = self.bitmaps[name].resize(n) if name in self.bitmaps else IdBitmap(n)
+            base = self.bitmap_size
+            if base < n:
+                # Concepts added after the offline build: source from the id, properties from the delta
+                if key == 'source':
+                    tail = [i for i in range(base, n) if id_source(self.faiss_map.get(i, '')) == value]
+                elif self.has_delta:
+                    rev = self.faiss_ids()
+                    res = self.db.execute("SELECT id FROM delta.props WHERE key=? AND val_str=?", [key, str(value)])
+                    tail = [rev[r[0]] for r in res.fetchall() if r[0] in rev]
+                else:
+                    tail = []
+                bm = bm | IdBitmap.from_ids(tail, n)
+            return bm
+        return self.ids_to_bitmap(self.query_properties((key, op, value)))
+
+    def property_bitmap(self, predicates, mode='and'):
+        """Combines predicate bitmaps with AND / OR (use ~ and - on the result for NOT / AND NOT)."""
+        result = None
+        for pred in predicates:
+            bm = self.predicate_bitmap(*pred)
+            result = bm if result is None else (result & bm if mode == 'and' else result | bm)
+        return result if result is not None else IdBitmap(self.index.ntotal)
+
+    def add_properties(self, cid, properties):
+        """Buffers a learned concept's properties (replaces any earlier learn of the same id)."""
+        self.pending_props[cid] = properties
+
+    def _attach_delta(self, write=False):
+        """
+        (Re)attaches the learned-property delta and rebuilds the `props` view over base + delta.
+        Between writes the delta is held read-only (a shared lock), so any number of CRS processes can
+        read side by side. False if it does not exist yet or another process holds the write lock.
+        """
+        if self.has_delta: self.db.execute("DETACH delta")
+        self.has_delta = False
+        if write or os.path.exists(self.delta_path):
+            try:
+                self.db.execute(f"ATTACH '{self.delta_path}' AS delta {'' if write else '(READ_ONLY)'}")
+                self.has_delta = True
+                if write:
+                    self.db.execute("CREATE TABLE IF NOT EXISTS delta.props "
+                                    "(id VARCHAR, key VARCHAR, val_str VARCHAR, val_num DOUBLE)")
+            except duckdb.IOException:
+                pass
+        tables = ["SELECT * FROM base.props"] + (["SELECT * FROM delta.props"] if self.has_delta else [])
+        self.db.execute(f"CREATE OR REPLACE TEMP VIEW props AS {' UNION ALL '.join(tables)}")
+        return self.has_delta
+
+    def flush_properties(self, retries=5):
+        """
+        Writes buffered properties to the delta table in one bulk insert.
+        The write lock is taken only for the insert; while other processes are reading the delta
+        the write is retried, and if they never let go the properties stay buffered for the next flush.
+        """
+        if not self.pending_props: return 0
+        ids, keys, vals = [], [], []
+        for cid, props in self.pending_props.items():
+            for p in props:
+                ids.append(cid)
+                keys.append(p['key'])
+                vals.append(str(p['value']))
+        batch = pa.Table.from_arrays([pa.array(ids, pa.string()), pa.array(keys, pa.string()),
+                                      pa.array(vals, pa.string())], schema=PROPS_SCHEMA)
+        cids = list(self.pending_props)
+
+        for attempt in range(retries):
+            if self._attach_delta(write=True): break
+            time.sleep(0.2 * (attempt + 1))
+        else:
+            self._attach_delta()
+            print(f"   ⚠️ Property delta is in use by another process; {len(cids)} concepts stay buffered.")
+            return 0
+        try:
+            self.db.execute(f"DELETE FROM delta.props WHERE id IN ({','.join('?' * len(cids))})", cids)
+            self.db.register('props_batch', batch)
+            self.db.execute("INSERT INTO delta.props SELECT id, key, val_str, TRY_CAST(val_str AS DOUBLE) FROM props_batch")
+            self.db.unregister('props_batch')
+        finally:
+            self._attach_delta()  # back to read-only: release the write lock
+        self.pending_props = {}
+        return len(ids)
+
+    def filter_properties(self, key, val):
+        return self.query_properties((key, '=', val))
+
+    def related_ids(self, cid, rel_types=None, hops=1, direction='out'):
+        """Concept ids reachable from cid within `hops`, optionally only along the given relation types."""
+        if cid not in self.node_map: return []
+        mask = self._reachable_mask(cid, rel_types, hops, direction)
+        return [self.rev_node_map[i] for i in np.flatnonzero(mask)]
+
+    def _reachable_mask(self, cid, rel_types, hops, direction):
+        allowed = None
+        if rel_types is not None:
+            allowed = np.array(self.rel_types.lookup(rel_types), dtype=np.int32)
+        seeds = [self.node_map[cid]]
+        mask = np.zeros(len(self.node_map), dtype=bool)
+        if direction in ('out', 'both'):
+            mask |= G.reachable(self.graph_layers(), seeds, hops, allowed, len(self.node_map))
+        if direction in ('in', 'both'):
+            mask |= G.reachable(self.graph_in(), seeds, hops, allowed, len(self.node_map))
+        return mask
+
+    def hybrid_search(self, embedding, k=10, where=None, mode='and',
+                      related_to=None, rel_types=None, hops=1, direction='out', within=None, exact_below=4096):
+        """
+        Top-k vector search restricted to concepts that pass property and graph filters.
+        where:      property predicates, as in query_properties (combined with `mode`)
+        related_to: only concepts reachable from this concept id within `hops`
+                    (rel_types limits the edges followed; direction='in' follows edges backwards,
+                     e.g. related_to=animal, rel_types=['is_a'], direction='in' -> kinds of animal)
+        within:     optional IdBitmap to intersect with (e.g. composed with property_bitmap)
+        The filters become a FAISS IDSelectorBitmap, so HNSW only returns allowed ids.
+        Small candidate sets (< exact_below) are scored exactly instead of through the graph index.
+        Returns [(concept_id, distance)] best first.
+        """
+        faiss_rev = self.faiss_ids()
+        allowed = within  # IdBitmap over FAISS rows (None = unrestricted)
+
+        # 1. Property filter (persisted bitmaps, else one SQL round trip)
+        if where:
+            bm = self.property_bitmap(where, mode)
+            allowed = bm if allowed is None else allowed & bm
+
+        # 2. Graph filter
+        if related_to is not None:
+            rows = []
+            if related_to in self.node_map:
+                nodes = np.flatnonzero(self._reachable_mask(related_to, rel_types, hops, direction))
+                rows = [faiss_rev[self.rev_node_map[n]] for n in nodes if self.rev_node_map[n] in faiss_rev]
+            bm = IdBitmap.from_ids(rows, self.index.ntotal)
+            allowed = bm if allowed is None else allowed & bm
+
+        vec = np.array([embedding]).astype('float32')
+        if allowed is None:
+            D, I = self.index.search(vec, k)
+        else:
+            candidates = allowed.resize(self.index.ntotal).to_ids()
+            if len(candidates) == 0: return []
+            if len(candidates) < exact_below:
+                # Exact distances over the few survivors beat a filtered graph walk
+                vecs = self.index.reconstruct_batch(candidates)
+                dists = ((vecs - vec) ** 2).sum(axis=1)
+                top = np.argsort(dists)[:k]
+                D, I = dists[top][None, :], candidates[top][None, :]
+            else:
+                sel = allowed.resize(self.index.ntotal).selector()
+                params = faiss.SearchParametersHNSW(sel=sel, efSearch=max(64, 2 * k))
+                D, I = self.index.search(vec, k, params=params)
+
+        return [(self.faiss_map[int(i)], float(d)) for d, i in zip(D[0], I[0]) if i != -1]
+
     def get_relations(self, cid):
         if cid not in self.node_map: return []
         idx = self.node_map[cid]
-        row = self.graph[idx]
-        targets = row.indices
-        return [self.rev_node_map[t] for t in targets]
\ No newline at end of file
+        _, targets, _, _ = G.neighbours(self.graph_layers(), [idx])
+        return [self.rev_node_map[t] for t in targets.tolist()]
\ No newline at end of file
@@ -0,0 +1,238 @@
+import glob
+import json
+import os
+import time
+import lmdb
+import numpy as np
+
+# Sub-databases of the shared CRS environment (<root>/storage)
+DATABASES = ('concepts', 'labels', 'label_deletes', 'embeddings', 'id_maps', 'metadata', 'graph_delta')
+DUPSORT = {'label_deletes'}
+# Durability vs. write speed:
+#   safe   - fsync data + meta on every commit (default)
+#   fast   - skip the meta fsync: a crash can lose the last commit, never corrupts
+#   nosync - leave flushing to the OS (bulk loads; call sync() at the end)
+SYNC_MODES = {'safe': {'sync': True, 'metasync': True},
+              'fast': {'sync': True, 'metasync': False},
+              'nosync': {'sync': False, 'metasync': False}}
+
+# Embeddings live outside the Concept FlatBuffers: one LMDB sub-database keyed "<modality>:<concept id>".
+# Values are a 1-byte dtype tag + raw little-endian floats (float16 by default: ~half the bytes of
+# float32 and well within what nearest-neighbour search needs; pass float32 where exact values matter).
+EMBEDDING_DTYPE = np.float16
+EMBEDDING_FIELDS = {'text': 'text_embedding', 'image': 'image_embedding'}
+_TAGS = {b'h': '<f2', b'f': '<f4'}
+
+
+class Storage:
+    """
+    One LMDB environment with named sub-databases, shared by packing, the label index and CRS,
+    so every component uses the same map size, sync mode and open handle (LMDB allows only one per process).
+    Write transactions go through write(), which doubles map_size and retries when the map fills up.
+    Environments packed before sub-databases existed keep their concepts in the unnamed main DB.
+    """
+
+    def __init__(self, path, readonly=False, map_size=256 * 1024 * 1024, sync='safe', databases=DATABASES):
+        self.path = path
+        self.readonly = readonly
+        if not readonly: os.makedirs(path, exist_ok=True)
+        self.env = lmdb.open(path, readonly=readonly, lock=not readonly, map_size=map_size,
+                             max_dbs=len(databases) + 2, **SYNC_MODES[sync])
+        self.dbs = {}
+        for name in databases:
+            try:
+                self.dbs[name] = self.env.open_db(name.encode('utf-8'), create=not readonly, dupsort=name in DUPSORT)
+            except lmdb.NotFoundError:
+                pass  # read-only and not written yet
+
+    def __contains__(self, name):
+        return name in self.dbs
+
+    def db(self, name):
+        return self.dbs[name]
+
+    def begin(self, name=None, write=False):
+        return self.env.begin(db=self.dbs[name] if name else None, write=write)
+
+    def grow(self):
+        size = self.env.info()['map_size'] * 2
+        self.env.set_mapsize(size)
+        return size
+
+    def write(self, fn, name=None):
+        """fn(txn) in one write transaction; on MapFullError the map is doubled and fn re-run (keep it idempotent)."""
+        while True:
+            try:
+                with self.begin(name, write=True) as txn:
+                    return fn(txn)
+            except lmdb.MapFullError:
+                print(f"   💾 LMDB map full, growing to {self.grow() // (1024 * 1024)} MB")
+
+    def read(self, fn, name=None):
+        """fn(txn) in a read transaction; if another process grew the map meanwhile, adopt its size and re-run."""
+        try:
+            with self.begin(name) as txn: return fn(txn)
+        except lmdb.MapResizedError:
+            self.env.set_mapsize(0)
+            with self.begin(name) as txn: return fn(txn)
+
+    def get(self, name, key):
+        return self.read(lambda txn: txn.get(key), name)
+
+    def put_many(self, name, items):
+        items = list(items)
+        return self.write(lambda txn: sum(txn.put(k, v) for k, v in items), name)
+
+    def bulk_load(self, name, items, batch_items=10_000, batch_bytes=64 * 1024 * 1024):
+        """
+        Writes (key, value) pairs, which must come sorted by key without duplicates, in bounded commits
+        (batch_items / batch_bytes), so the dirty page set never grows with the input.
+        A batch whose first key sorts after the sub-db's last key goes in with putmulti(append=True):
+        sequential leaf fill, no page splits or key searches. Otherwise (re-runs, merges into existing
+        data) it falls back to overwriting puts, so loading the same data twice is safe.
+        Returns {'items', 'bytes', 'appended', 'seconds'}.
+        """
+        db = self.dbs[name]
+        stats = {'items': 0, 'bytes': 0, 'appended': 0}
+        start = time.time()
+
+        def commit(chunk):
+            def put(txn):
+                cur = txn.cursor(db=db)
+                if not cur.last() or chunk[0][0] > cur.key():
+                    cur.putmulti(chunk, append=True)
+                    return len(chunk)
+                for k, v in chunk: txn.put(k, v, db=db)
+                return 0
+            stats['appended'] += self.write(put, name)
+            stats['items'] += len(chunk)
+
+        chunk, size = [], 0
+        for key, value in items:
+            chunk.append((key, value))
+            size += len(key) + len(value)
+            if len(chunk) >= batch_items or size >= batch_bytes:
+                commit(chunk)
+                stats['bytes'] += size
+                chunk, size = [], 0
+        if chunk:
+            commit(chunk)
+            stats['bytes'] += size
+        stats['seconds'] = time.time() - start
+        return stats
+
+    def get_concept(self, cid):
+        """Packed Concept FlatBuffer bytes (concepts sub-db, then the legacy unnamed DB), or None."""
+        key = cid.encode('utf-8')
+        buf = self.get('concepts', key) if 'concepts' in self.dbs else None
+        return buf if buf is not None else self.get(None, key)
+
+    # --- id maps (vector row -> concept id, for rows appended after the offline build) ---
+
+    def put_id_map(self, modality, mapping):
+        self.put_many('id_maps', ((f"{modality}:{row}".encode('utf-8'), cid.encode('utf-8')) for row, cid in mapping.items()))
+
+    def id_map(self, modality):
+        if 'id_maps' not in self.dbs: return {}
+        prefix = f"{modality}:".encode('utf-8')
+
+        def scan(txn):
+            out = {}
+            cur = txn.cursor()
+            if cur.set_range(prefix):
+                for k, v in cur:
+                    if not k.startswith(prefix): break
+                    out[int(k[len(prefix):])] = v.decode('utf-8')
+            return out
+        return self.read(scan, 'id_maps')
+
+    def clear(self, name):
+        if name in self.dbs: self.write(lambda txn: txn.drop(self.dbs[name], delete=False))
+
+    # --- metadata (small JSON values: build info, pack stats) ---
+
+    def put_meta(self, key, value):
+        self.put_many('metadata', [(key.encode('utf-8'), json.dumps(value).encode('utf-8'))])
+
+    def get_meta(self, key, default=None):
+        if 'metadata' not in self.dbs: return default
+        val = self.get('metadata', key.encode('utf-8'))
+        return json.loads(val) if val is not None else default
+
+    def stats(self):
+        """Map/usage info plus per-sub-db entry counts, B-tree depth and size."""
+        info, env_stat = self.env.info(), self.env.stat()
+        psize = env_stat['psize']
+        out = {'path': self.path, 'map_size': info['map_size'], 'used': (info['last_pgno'] + 1) * psize,
+               'readers': info['num_readers'], 'dbs': {}}
+
+        def db_stats(txn):
+            for name, db in [('', None)] + list(self.dbs.items()):
+                st = txn.stat(db) if db is not None else env_stat
+                out['dbs'][name or '(main)'] = {
+                    'entries': st['entries'], 'depth': st['depth'],
+                    'bytes': (st['branch_pages'] + st['leaf_pages'] + st['overflow_pages']) * psize}
+        self.read(db_stats)
+        return out
+
+    def sync(self):
+        self.env.sync(True)
+
+    def close(self):
+        self.env.close()
+
+
+def embedding_key(cid, modality='text'):
+    return f"{modality}:{cid}".encode('utf-8')
+
+
+def encode_embedding(vec, dtype=EMBEDDING_DTYPE):
+    tag = b'h' if np.dtype(dtype) == np.float16 else b'f'
+    return tag + np.asarray(vec, dtype=_TAGS[tag]).tobytes()
+
+
+def decode_embedding(buf):
+    buf = bytes(buf)
+    return np.frombuffer(buf, dtype=_TAGS[buf[:1]], offset=1).astype(np.float32)
+
+
+def sidecar_path(concepts_dir, cid, modality='text'):
+    # Loose embedding next to the concept's .bin until pack time
+    return os.path.join(concepts_dir, f"{cid}.{modality}.emb")
+
+
+def write_sidecars(concepts_dir, data, dtype=EMBEDDING_DTYPE):
+    for modality, field in EMBEDDING_FIELDS.items():
+        if data.get(field) is None or len(data[field]) == 0: continue
+        with open(sidecar_path(concepts_dir, data['id'], modality), 'wb') as f:
+            f.write(encode_embedding(data[field], dtype))
+
+
+def pack_sidecars(storage, concepts_dir):
+    """Moves loose *.emb files into the `embeddings` sub-db. Returns the files packed."""
+    files = glob.glob(os.path.join(concepts_dir, "*.emb"))
+    if not files: return files
+
+    keyed = []
+    for filepath in files:
+        cid, modality = os.path.basename(filepath)[:-len('.emb')].rsplit('.', 1)
+        keyed.append((embedding_key(cid, modality), filepath))
+    keyed.sort()
+    storage.bulk_load('embeddings', read_files(keyed))
+    return files
+
+
+def concept_files(concepts_dir):
+    """[(key, path)] for the loose concept records, sorted by LMDB key (the order bulk_load needs)."""
+    keyed = [(os.path.splitext(os.path.basename(p))[0].encode('utf-8'), p)
+             for p in glob.glob(os.path.join(concepts_dir, "*.bin"))]
+    keyed.sort()
+    return keyed
+
+
+def read_files(keyed, progress=None):
+    """Streams (key, file bytes) for bulk_load; only one batch of values is ever held in memory."""
+    for key, filepath in keyed:
+        with open(filepath, 'rb') as f:
+            yield key, f.read()
+        if progress: progress.update(1)
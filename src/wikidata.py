@@ -1,27 +1,149 @@
 import requests
 import time
+import json
+import gzip
+import bz2
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from src.cache import ResponseCache
+
+WIKIDATA_API = "https://www.wikidata.org/w/api.php"
+MAX_IDS_PER_REQUEST = 50  # wbgetentities limit for non-bot clients
+DAY = 24 * 3600
+
+# Curated names win over Wikidata's own labels (kept stable for existing DuckDB keys)
+CORE_PROPERTY_LABELS = {
+    'P31': 'instance of',
+    'P279': 'subclass of',
+    'P106': 'occupation',
+    'P39': 'position held',
+    'P569': 'date of birth',
+    'P2048': 'height',
+    'P2218': 'net worth',
+    'P856': 'website',
+    'P17': 'country'
+}
+
+
+def open_dump(path, mode='rt'):
+    """Opens plain, .gz or .bz2 dump files transparently."""
+    if path.endswith('.gz'): return gzip.open(path, mode, encoding='utf-8')
+    if path.endswith('.bz2'): return bz2.open(path, mode, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class PropertyLabels:
+    """
+    P-code -> English label table.
+    Held as a plain dict for the parse loop, persisted in a SQLite table next to the response cache.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.table = {}
+        if cache:
+            with cache.lock:
+                cache.con.execute("CREATE TABLE IF NOT EXISTS prop_labels (pid TEXT PRIMARY KEY, label TEXT)")
+                self.table.update(cache.con.execute("SELECT pid, label FROM prop_labels").fetchall())
+        self.table.update(CORE_PROPERTY_LABELS)
+
+    def missing(self, pids):
+        return [p for p in dict.fromkeys(pids) if p not in self.table]
+
+    def store(self, labels):
+        labels = {p: l for p, l in labels.items() if p not in CORE_PROPERTY_LABELS}
+        self.table.update(labels)
+        if self.cache and labels:
+            with self.cache.lock:
+                self.cache.con.executemany("INSERT OR REPLACE INTO prop_labels VALUES (?, ?)", labels.items())
+                self.cache.con.commit()
+
+    def load_file(self, path):
+        """
+        Preloads labels from a local file:
+        - TSV lines "P31<TAB>instance of"
+        - JSON lines / Wikidata dump lines for property entities ({"id": "P31", "labels": {"en": ...}})
+        """
+        labels = {}
+        with open_dump(path) as f:
+            for line in f:
+                line = line.strip().rstrip(',')
+                if not line or line in '[]': continue
+                if line.startswith('{'):
+                    ent = json.loads(line)
+                    lbl = ent.get('labels', {}).get('en', {}).get('value')
+                    if ent.get('id', '').startswith('P') and lbl: labels[ent['id']] = lbl
+                else:
+                    pid, _, lbl = line.partition('\t')
+                    if lbl: labels[pid] = lbl
+        self.store(labels)
+        return len(labels)
 
 
 class WikidataFetcher:
-    def __init__(self):
-        self.endpoint = "https://www.wikidata.org/w/api.php"
+    def __init__(self, endpoint=WIKIDATA_API, timeout=(3.05, 10), retries=3, backoff=0.5, pool_size=8,
+                 cache_path=None, ttl=30 * DAY, negative_ttl=DAY, offline=False):
+        self.endpoint = endpoint
         self.headers = {'User-Agent': 'CRS_Bot/1.0 (Commercial_Safe_Open_Source)'}
+        self.timeout = timeout  # (connect, read) seconds
 
-        # Simple cache for property labels to make answers readable
-        self.prop_map = {
-            'P31': 'instance of',
-            'P279': 'subclass of',
-            'P106': 'occupation',
-            'P39': 'position held',
-            'P569': 'date of birth',
-            'P2048': 'height',
-            'P2218': 'net worth',
-            'P856': 'website',
-            'P17': 'country'
-        }
+        # One keep-alive session for every call: TCP+TLS handshake is paid once per pooled connection.
+        # Retries cover connection errors and throttling/5xx with exponential backoff (Retry-After honoured).
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(['GET']))
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.stats = {'requests': 0, 'errors': 0, 'seconds': 0.0}
+
+        # On-disk response cache: raw entities + search hits, misses cached for negative_ttl.
+        # offline=True never touches the network and answers from the cache only.
+        self.cache = ResponseCache(cache_path) if cache_path else None
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.offline = offline
+
+        # Property labels (P31 -> instance of): curated core + every label seen so far, persisted
+        self.labels = PropertyLabels(self.cache)
+        self.prop_map = self.labels.table
+
+    def _get(self, params):
+        start = time.perf_counter()
+        self.stats['requests'] += 1
+        try:
+            r = self.session.get(self.endpoint, params=params, timeout=self.timeout)
+            r.raise_for_status()
+            return r.json()
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self.stats['seconds'] += time.perf_counter() - start
+
+    def connection_stats(self):
+        """Request counters plus how many of those requests reused a pooled connection."""
+        opened = 0
+        pool_requests = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            pool_requests += pool.num_requests
+        stats = dict(self.stats)
+        stats['connections_opened'] = opened
+        stats['connections_reused'] = max(pool_requests - opened, 0)
+        return stats
 
     def search_entity(self, label):
         """Finds the Wikidata ID (Q-ID)"""
+        key = f"search:{label.strip().lower()}"
+        if self.cache:
+            found, qid = self.cache.get(key)
+            if found: return qid
+        if self.offline: return None
+
         params = {
             'action': 'wbsearchentities',
             'search': label,
@@ -30,71 +152,124 @@ class WikidataFetcher:
             'limit': 1
         }
         try:
-            r = requests.get(self.endpoint, params=params, headers=self.headers)
-            data = r.json()
-            if data.get('search'):
-                return data['search'][0]['id']
+            data = self._get(params)
+            qid = data['search'][0]['id'] if data.get('search') else None
+            if self.cache: self.cache.put(key, qid, self.ttl if qid else self.negative_ttl)
+            return qid
         except Exception as e:
             print(f"   ⚠️ Wiki Error: {e}")
         return None
 
     def get_details(self, qid):
         """Fetches Description + Claims"""
-        if not qid: return None, [], []
+        if not qid: return None, None, [], []
+        details = self.get_details_batch([qid])
+        return details.get(qid) or ("No description available.", qid, [], [])
 
-        params = {
-            'action': 'wbgetentities',
-            'ids': qid,
-            'props': 'descriptions|claims|labels',
-            'languages': 'en',
-            'format': 'json'
-        }
+    def get_details_batch(self, qids, chunk_size=MAX_IDS_PER_REQUEST):
+        """
+        Fetches many entities with one wbgetentities call per chunk (ids=Q1|Q2|...).
+        Returns {qid: (description, label, props, rels)}; failed/missing ids are left out.
+        """
+        qids = list(dict.fromkeys(q for q in qids if q))  # de-dupe, keep order
 
-        props_out = []
-        rels_out = []
-        description = "No description available."
-        label = qid
+        # 1. Serve what we can from the disk cache (None = known-missing entity)
+        entities = {}
+        if self.cache:
+            cached = self.cache.get_many([f"entity:{q}" for q in qids])
+            for qid in qids:
+                found, entity = cached.get(f"entity:{qid}", (False, None))
+                if found and entity: entities[qid] = entity
+            qids = [q for q in qids if f"entity:{q}" not in cached]
 
-        try:
-            r = requests.get(self.endpoint, params=params, headers=self.headers)
-            data = r.json()
-            entity = data.get('entities', {}).get(qid, {})
-
-            # 1. Get Real Description
-            desc_obj = entity.get('descriptions', {}).get('en', {})
-            if desc_obj:
-                description = desc_obj.get('value', description)
-
-            # 2. Get Real Label
-            lbl_obj = entity.get('labels', {}).get('en', {})
-            if lbl_obj:
-                label = lbl_obj.get('value', label)
-
-            # 3. Get Properties
-            claims = entity.get('claims', {})
-
-            for prop_id, items in claims.items():
-                # Map P codes to text (e.g. P31 -> instance of)
-                human_key = self.prop_map.get(prop_id, prop_id)
-
-                for item in items[:2]:  # Limit to top 2 values per property
-                    mainsnak = item.get('mainsnak', {})
-                    datavalue = mainsnak.get('datavalue', {})
-                    dtype = mainsnak.get('datatype', '')
-
-                    # Handle Strings/Amounts
-                    if dtype in ['string', 'quantity']:
-                        val = datavalue.get('value')
-                        if isinstance(val, dict): val = val.get('amount', str(val))
-                        props_out.append({'key': human_key, 'value': str(val).replace('+', '')})
-
-                    # Handle Relations (Wiki Items)
-                    elif dtype == 'wikibase-item':
-                        target_id = datavalue.get('value', {}).get('id')
-                        if target_id:
-                            rels_out.append({'type': human_key, 'target_id': f"wiki_{target_id}", 'source': 'wikidata'})
+        # 2. Fetch the rest from the API
+        if not self.offline:
+            entities.update(self._fetch_entities(qids, chunk_size))
 
-        except Exception as e:
-            pass
+        # 3. Resolve every unseen property label once, then parse with plain dict lookups
+        self.resolve_property_labels(pid for e in entities.values() for pid in e.get('claims', {}))
+        return {qid: parse_entity(entity, self.prop_map) for qid, entity in entities.items()}
+
+    def _fetch_entities(self, qids, chunk_size=MAX_IDS_PER_REQUEST, props='descriptions|claims|labels'):
+        entities = {}
+        for i in range(0, len(qids), chunk_size):
+            chunk = qids[i:i + chunk_size]
+            params = {
+                'action': 'wbgetentities',
+                'ids': '|'.join(chunk),
+                'props': props,
+                'languages': 'en',
+                'format': 'json'
+            }
+            try:
+                data = self._get(params)
+            except Exception as e:
+                print(f"   ⚠️ Wiki Error: {e}")
+                continue
+            found, missing = {}, {}
+            for qid, entity in data.get('entities', {}).items():
+                if 'missing' in entity:
+                    missing[f"entity:{qid}"] = None
+                    continue
+                found[f"entity:{qid}"] = entity
+                entities[qid] = entity
+            if self.cache and props == 'descriptions|claims|labels':
+                self.cache.put_many(found, self.ttl)
+                self.cache.put_many(missing, self.negative_ttl)
+        return entities
+
+    def resolve_property_labels(self, pids):
+        """Batch-fetches labels for P-codes not in the table yet (50 per request)."""
+        unknown = self.labels.missing(pids)
+        if not unknown or self.offline: return
+        fetched = self._fetch_entities(unknown, props='labels')
+        labels = {}
+        for pid in unknown:
+            lbl = fetched.get(pid, {}).get('labels', {}).get('en', {}).get('value')
+            # Unlabelled ids keep their P-code so they aren't re-requested on every parse
+            if pid in fetched: labels[pid] = lbl or pid
+        self.labels.store(labels)
+
+
+def parse_entity(entity, prop_map):
+    """Turns one wbgetentities/dump entity into (description, label, props, rels)."""
+    props_out = []
+    rels_out = []
+    description = "No description available."
+    label = entity.get('id')
+
+    # 1. Get Real Description
+    desc_obj = entity.get('descriptions', {}).get('en', {})
+    if desc_obj:
+        description = desc_obj.get('value', description)
+
+    # 2. Get Real Label
+    lbl_obj = entity.get('labels', {}).get('en', {})
+    if lbl_obj:
+        label = lbl_obj.get('value', label)
+
+    # 3. Get Properties
+    claims = entity.get('claims', {})
+
+    for prop_id, items in claims.items():
+        # Map P codes to text (e.g. P31 -> instance of)
+        human_key = prop_map.get(prop_id, prop_id)
+
+        for item in items[:2]:  # Limit to top 2 values per property
+            mainsnak = item.get('mainsnak', {})
+            datavalue = mainsnak.get('datavalue', {})
+            dtype = mainsnak.get('datatype', '')
+
+            # Handle Strings/Amounts
+            if dtype in ['string', 'quantity']:
+                val = datavalue.get('value')
+                if isinstance(val, dict): val = val.get('amount', str(val))
+                props_out.append({'key': human_key, 'value': str(val).replace('+', '')})
+
+            # Handle Relations (Wiki Items)
+            elif dtype == 'wikibase-item':
+                target_id = (datavalue.get('value') or {}).get('id')
+                if target_id:
+                    rels_out.append({'type': human_key, 'target_id': f"wiki_{target_id}", 'source': 'wikidata'})
 
-        return description, label, props_out, rels_out
\ No newline at end of file
+    return description, label, props_out, rels_out
@@ -0,0 +1,106 @@
+import json
+import os
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from src.wikidata import open_dump, parse_entity, CORE_PROPERTY_LABELS
+
+# Worker-process state (set once per process by _init_worker, not pickled per chunk)
+_FILTER = {}
+
+
+def iter_dump_lines(path):
+    """Yields one entity JSON line at a time from a Wikidata JSON dump (plain/.gz/.bz2)."""
+    with open_dump(path) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) < 3: continue  # the dump is one big JSON array: skip "[" / "]"
+            yield line.rstrip(',')
+
+
+def _chunks(lines, size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+
+def _init_worker(qids, props, prop_labels):
+    _FILTER['qids'] = qids
+    _FILTER['props'] = props
+    _FILTER['labels'] = prop_labels
+
+
+def entity_to_concept(entity, props=None, prop_labels=CORE_PROPERTY_LABELS):
+    """Maps one dump entity to the concept dict ConceptBuilder / CRSIndexer consume (None if unusable)."""
+    label = entity.get('labels', {}).get('en', {}).get('value')
+    if not label: return None
+    qid = entity['id']
+    if props is not None:
+        entity['claims'] = {p: v for p, v in entity.get('claims', {}).items() if p in props}
+
+    description, label, w_props, w_rels = parse_entity(entity, prop_labels)
+    aliases = [a['value'] for a in entity.get('aliases', {}).get('en', [])]
+    w_props.append({'key': 'wikidata_id', 'value': qid})
+    return {
+        'id': f"wiki_{qid}",
+        'label': label,
+        'aliases': aliases,
+        'definition': description,
+        'relations': w_rels,
+        'properties': w_props,
+        'evidence': [{'source_type': 'wikidata', 'url': f"wikidata.org/wiki/{qid}", 'snippet': 'Dump'}]
+    }
+
+
+def _parse_chunk(lines):
+    qids, props, labels = _FILTER['qids'], _FILTER['props'], _FILTER['labels']
+    out = []
+    for line in lines:
+        # Cheap pre-filter on the raw line before paying for json.loads
+        if qids is not None:
+            start = line.find('"id":"')
+            if start != -1 and line[start + 6:line.find('"', start + 6)] not in qids: continue
+        try:
+            entity = json.loads(line)
+        except ValueError:
+            continue
+        if entity.get('type') != 'item': continue
+        if qids is not None and entity.get('id') not in qids: continue
+        concept = entity_to_concept(entity, props, labels)
+        if concept: out.append(concept)
+    return out
+
+
+def stream_concepts(path, qids=None, props=None, prop_labels=None, workers=None, chunk_lines=2000,
+                    limit=None, prefetch=2):
+    """
+    Parses a Wikidata JSON dump on a process pool and yields concept dicts in dump order.
+    qids:  optional set of Q-ids to keep (everything else is skipped)
+    props: optional set of P-codes to keep in claims
+    prop_labels: P-code -> label table (e.g. WikidataFetcher(...).prop_map)
+    limit: stop (and shut the pool down) after this many concepts
+    At most `prefetch` chunks per worker are in flight ahead of the consumer, so memory stays bounded
+    however slowly the caller (e.g. the embedder) drains the stream.
+    """
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    labels = dict(prop_labels or CORE_PROPERTY_LABELS)
+    qids = set(qids) if qids is not None else None
+    props = set(props) if props is not None else None
+    window = workers * prefetch
+
+    chunks = _chunks(iter_dump_lines(path), chunk_lines)
+    in_flight = deque()
+    emitted = 0
+    with Pool(workers, initializer=_init_worker, initargs=(qids, props, labels)) as pool:
+        while True:
+            for chunk in islice(chunks, window - len(in_flight)):
+                in_flight.append(pool.apply_async(_parse_chunk, (chunk,)))
+            if not in_flight: return
+            for concept in in_flight.popleft().get():
+                yield concept
+                emitted += 1
+                if limit and emitted >= limit: return